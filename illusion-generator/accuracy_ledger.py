@@ -0,0 +1,243 @@
+"""Running accuracy counts that follow the participant files of a live study.
+
+Usage:
+    python accuracy_ledger.py results/ --achromatic achromat/
+    python accuracy_ledger.py results/ --ledger study.sqlite --by-stimulus
+
+The analysis tool recomputes every pattern x color accuracy from all files
+on each run. This keeps the correct and total counts per (saturation
+pattern, color scheme, stimulus) in a small SQLite file, with the
+contribution of every participant file, and on each run only reads the
+files that are new or changed:
+
+    - a file whose size and modification time match the ledger is skipped
+    - a file whose size or time changed is hashed, and only read again if
+      its contents changed; its old counts are replaced by the new ones
+    - a recorded file that no longer exists is removed from the counts
+
+Trials are cleaned as in response_ingest.py. A trial is correct when its
+response equals CORRECT_ANSWERS of its pattern, the mapping of the analysis
+tool, and counts toward the total when it has a response at all. Patterns
+outside the mapping are not counted.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from response_ingest import csv_files, load_responses
+
+LEDGER_NAME = "accuracy.sqlite"
+# Response of a correct answer per saturation pattern: 0 inward, 1 outward
+CORRECT_ANSWERS = {
+    "100-70-40-10": 1,
+    "10-40-70-100": 0,
+    "100-70-70-10": 1,
+    "10-70-70-100": 0,
+    "100-40-40-10": 1,
+    "10-40-40-100": 0
+}
+# Order of the patterns in the analysis tool's figures
+PATTERN_ORDER = ["10-40-70-100", "100-70-40-10", "10-40-40-100", "10-70-70-100", "100-40-40-10", "100-70-70-10"]
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def trial_outcomes(table):
+    """Score the trials of a response table against CORRECT_ANSWERS.
+
+    Returns (trials, correct, answered): the trials whose pattern has an
+    answer, and boolean arrays of the correct and the answered ones.
+    """
+    patterns, pattern_index = np.unique(table["saturation_pattern"], return_inverse=True)
+    answers = np.array([CORRECT_ANSWERS.get(p, np.nan) for p in patterns.tolist()], dtype=np.float64)
+    answers = answers[pattern_index.reshape(-1)]
+    known = ~np.isnan(answers)
+    trials = table[known]
+    answered = ~np.isnan(trials["response"])
+    return trials, answered & (trials["response"] == answers[known]), answered
+
+
+def cell_counts(table):
+    """Correct and total counts of a response table per file and cell.
+
+    Returns a list of (file, saturation_pattern, color_scheme, stimulus,
+    correct, total) tuples.
+    """
+    trials, correct, answered = trial_outcomes(table)
+    cells, inverse = np.unique(trials[["file", "saturation_pattern", "color_scheme", "stimulus"]],
+                               return_inverse=True)
+    inverse = inverse.reshape(-1)
+    correct_counts = np.bincount(inverse, correct, len(cells)).astype(np.int64)
+    total_counts = np.bincount(inverse, answered, len(cells)).astype(np.int64)
+    return [cell + (c, t) for cell, c, t in zip(cells.tolist(), correct_counts.tolist(), total_counts.tolist())]
+
+
+def _name_batches(files):
+    """Split files into lists without repeated file names, as response tables name files without folders"""
+    batches = []
+    seen = {}
+    for file_path in files:
+        name = os.path.basename(file_path)
+        batch = seen.get(name, 0)
+        seen[name] = batch + 1
+        if batch == len(batches):
+            batches.append([])
+        batches[batch].append(file_path)
+    return batches
+
+
+class AccuracyLedger:
+    """SQLite record of the accuracy counts and the participant files they came from"""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, achromatic INTEGER, "
+                            "size INTEGER, mtime REAL, sha256 TEXT, updated REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS file_cells (file TEXT, saturation_pattern TEXT, "
+                            "color_scheme TEXT, stimulus TEXT, correct INTEGER, total INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS file_cells_file ON file_cells (file)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS cells (saturation_pattern TEXT, color_scheme TEXT, "
+                            "stimulus TEXT, correct INTEGER, total INTEGER, files INTEGER, "
+                            "PRIMARY KEY (saturation_pattern, color_scheme, stimulus))")
+
+    def _key(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.directory)
+
+    def _retract(self, key):
+        """Subtract the counts of a recorded file (inside a transaction)"""
+        # Correlated subqueries rather than UPDATE ... FROM, which needs SQLite 3.33
+        same_cell = ("FROM file_cells AS f WHERE f.file = :file AND f.saturation_pattern = cells.saturation_pattern "
+                     "AND f.color_scheme = cells.color_scheme AND f.stimulus = cells.stimulus")
+        self.db.execute(f"UPDATE cells SET correct = correct - (SELECT SUM(f.correct) {same_cell}), "
+                        f"total = total - (SELECT SUM(f.total) {same_cell}), files = files - 1 "
+                        f"WHERE EXISTS (SELECT 1 {same_cell})", {"file": key})
+        self.db.execute("DELETE FROM file_cells WHERE file = ?", (key,))
+        self.db.execute("DELETE FROM cells WHERE files = 0")
+
+    def pending(self, files, achromatic=False):
+        """Split files into (new or changed, unchanged) by size, modification time and contents.
+
+        Returns the changed files as (path, size, mtime, sha256) tuples.
+        Unchanged files with a new modification time get it recorded.
+        """
+        changed, unchanged = [], []
+        for file_path in files:
+            stat = os.stat(file_path)
+            row = self.db.execute("SELECT achromatic, size, mtime, sha256 FROM files WHERE file = ?",
+                                  (self._key(file_path),)).fetchone()
+            if row is not None and row[:3] == (int(achromatic), stat.st_size, stat.st_mtime):
+                unchanged.append(file_path)
+                continue
+            digest = _file_hash(file_path)
+            if row is not None and row[0] == int(achromatic) and row[3] == digest:
+                with self.db:
+                    self.db.execute("UPDATE files SET size = ?, mtime = ? WHERE file = ?",
+                                    (stat.st_size, stat.st_mtime, self._key(file_path)))
+                unchanged.append(file_path)
+            else:
+                changed.append((file_path, stat.st_size, stat.st_mtime, digest))
+        return changed, unchanged
+
+    def update(self, files, achromatic=False, workers=1):
+        """Fold the new and changed files into the counts. Returns (new, changed, unchanged) file counts."""
+        pending, unchanged = self.pending(files, achromatic)
+        known = {row[0] for row in self.db.execute("SELECT file FROM files")}
+        stats = {p[0]: p[1:] for p in pending}
+        for batch in _name_batches([p[0] for p in pending]):
+            counts = cell_counts(load_responses(batch, workers, achromatic))
+            by_name = {}
+            for row in counts:
+                by_name.setdefault(row[0], []).append(row[1:])
+            with self.db:
+                for file_path in batch:
+                    key = self._key(file_path)
+                    self._retract(key)
+                    cells = by_name.get(os.path.basename(file_path), [])
+                    self.db.executemany("INSERT INTO file_cells VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(key,) + cell for cell in cells])
+                    self.db.executemany("INSERT INTO cells VALUES (?, ?, ?, ?, ?, 1) "
+                                        "ON CONFLICT (saturation_pattern, color_scheme, stimulus) DO UPDATE SET "
+                                        "correct = correct + excluded.correct, "
+                                        "total = total + excluded.total, files = files + 1", cells)
+                    self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, int(achromatic)) + stats[file_path] + (time.time(),))
+        new = sum(self._key(p[0]) not in known for p in pending)
+        return new, len(pending) - new, len(unchanged)
+
+    def prune(self):
+        """Remove the counts of recorded files that no longer exist. Returns how many were removed."""
+        keys = [row[0] for row in self.db.execute("SELECT file FROM files")
+                if not os.path.exists(os.path.join(self.directory, row[0]))]
+        with self.db:
+            for key in keys:
+                self._retract(key)
+                self.db.execute("DELETE FROM files WHERE file = ?", (key,))
+        return len(keys)
+
+    def cells(self, by_stimulus=False):
+        """(saturation_pattern, color_scheme, [stimulus,] correct, total) rows of the running counts"""
+        columns = "saturation_pattern, color_scheme" + (", stimulus" if by_stimulus else "")
+        return self.db.execute(f"SELECT {columns}, SUM(correct), SUM(total) FROM cells "
+                               f"GROUP BY {columns} ORDER BY {columns}").fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def _pattern_rank(pattern):
+    return PATTERN_ORDER.index(pattern) if pattern in PATTERN_ORDER else len(PATTERN_ORDER)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update running accuracy counts from participant result CSVs")
+    parser.add_argument("inputs", nargs="*", help="Result CSV files or folders of them")
+    parser.add_argument("--achromatic", nargs="+", default=[],
+                        help="Result CSV files or folders of the achromatic control")
+    parser.add_argument("-l", "--ledger", default=LEDGER_NAME, help=f"State file (default: {LEDGER_NAME})")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of worker processes (0 uses every CPU core)")
+    parser.add_argument("--by-stimulus", action="store_true", help="Report every stimulus separately")
+    args = parser.parse_args(argv)
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    try:
+        ledger = AccuracyLedger(args.ledger)
+    except sqlite3.Error as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    try:
+        removed = ledger.prune()
+        chromatic = ledger.update(csv_files(args.inputs), False, workers)
+        achromatic = ledger.update(csv_files(args.achromatic), True, workers)
+        new, changed, unchanged = (a + b for a, b in zip(chromatic, achromatic))
+        rows = ledger.cells(args.by_stimulus)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        ledger.close()
+
+    print(f"{new} new, {changed} changed, {unchanged} unchanged, {removed} removed files", file=sys.stderr)
+    for row in sorted(rows, key=lambda r: (_pattern_rank(r[0]),) + r[:-2]):
+        correct, total = row[-2:]
+        accuracy = f"{correct / total:.3f}" if total else "nan"
+        print('\t'.join(row[:-2]) + f"\t{correct}/{total}\t{accuracy}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,573 @@
+"""Local HTTP server that runs adaptive procedures and renders each trial's stimulus on demand.
+
+Usage:
+    python adaptive_server.py serve --port 8765 --warm-grid
+    python adaptive_server.py simulate session.json --threshold -6 --noise 1.5
+
+Instead of a fixed set of pre-rendered images, an experiment asks the server
+for the next stimulus of an adaptive procedure over one generator parameter:
+
+    shift_angle   the shift angle of the pattern, in degrees
+    saturation    the saturation of every (non-gray) color, in percent
+    width_ratio   the width of the 1st and 3rd colors relative to the others
+
+The value moves on a grid from low to high in steps of step, using either a
+transformed up-down staircase or QUEST (a Bayesian procedure that places
+each trial at the posterior mean of the threshold). Every other setting comes
+from a project dict as saved by the GUI.
+
+API (JSON, except the images):
+    POST /sessions                  create a session, returns its id and first trial
+    GET  /sessions/<id>             settings, responses so far and the estimate
+    POST /sessions/<id>/responses   {"trial": n, "response": 0|1} or {"trial": n, "correct": bool},
+                                    returns the next trial
+    GET  /stimuli/<key>.png         the stimulus of a trial
+    GET  /stats                     stimuli served from memory, rendered on request and prefetched
+
+A session is created with {"parameter", "low", "high", "step"} and optionally
+"method" ("staircase" or "quest"), "start", "easier" ("higher" or "lower"
+values), "answer" (the response that counts as correct), "max_trials",
+"project", and the options of the procedure ("up", "down", "step_size", the
+grid values the staircase moves per step, "max_reversals"; "prior_sd",
+"slope", "guess", "lapse"). Every grid value must give a different stimulus,
+so "saturation" needs a project with non-gray colors; the default project is
+all gray.
+
+Stimuli are kept as encoded PNGs in memory, keyed by their render cache key.
+Whenever a trial is issued, the stimuli of the possible next trials (after a
+correct and after a wrong response) are rendered in the background, so the
+next image is usually ready before the participant answers. A stimulus that
+is not ready is rendered on request, which takes about 20 ms. simulate runs
+a session against a simulated observer and reports those latencies.
+"""
+import argparse
+import json
+import math
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from illusion_renderer import DEFAULT_SIZE, IllusionRasterizer
+from illusion_spec import IllusionSpec
+from png_export import encode_png
+from render_cache import cache_key
+
+DEFAULT_PORT = 8765
+PARAMETERS = ["shift_angle", "saturation", "width_ratio"]
+METHODS = ["staircase", "quest"]
+# Used for the settings a session does not give, the default pattern of the GUI
+DEFAULT_PROJECT = {
+    "background": {"color": "#808080", "saturation": 0.0, "transparent": False},
+    "colors": ["#000000", "#B0B0B0", "#FFFFFF", "#707070"],
+    "saturations": [100, 100, 100, 100],
+    "widths": [1.0, 1.0, 1.0, 1.0],
+    "num_patterns": 24,
+    "shift_angle": -12.5,
+    "use_classic_pattern": False
+}
+MAX_STIMULI = 512  # Encoded stimuli kept in memory, about 50 KB each
+
+
+def parameter_params(params, parameter, value):
+    """Copy of a project dict with one adaptive parameter set to value"""
+    params = dict(params)
+    num_colors = len(params["colors"])
+    if parameter == "shift_angle":
+        params["shift_angle"] = value
+    elif parameter == "saturation":
+        params["saturations"] = [value] * num_colors
+    elif parameter == "width_ratio":
+        params["widths"] = [value if i % 2 == 0 else 1.0 for i in range(num_colors)]
+    else:
+        raise ValueError(f"Unknown parameter {parameter}, expected one of {', '.join(PARAMETERS)}")
+    return params
+
+
+def value_grid(low, high, step):
+    """Values from low to high (inclusive) in steps of step"""
+    if step <= 0 or high < low:
+        raise ValueError("Expected low <= high and a positive step")
+    return np.round(low + np.arange(int(math.floor((high - low) / step + 1e-9)) + 1) * step, 6)
+
+
+class Staircase:
+    """Transformed up-down staircase on a value grid.
+
+    After down correct responses in a row the next trial is harder, after up
+    wrong responses in a row it is easier, by step grid values; 1-up 2-down
+    converges on 70.7% correct. easier is +1 when higher values are easier.
+    Finishes after max_reversals reversals, and estimates the threshold as
+    the mean value of the last (up to 6) reversals.
+    """
+
+    def __init__(self, grid, start, up=1, down=2, step=1, easier=1, max_reversals=12):
+        self.grid = grid
+        self.index = int(np.abs(grid - start).argmin())
+        self.up, self.down, self.step, self.easier = up, down, step, easier
+        self.max_reversals = max_reversals
+        self.run = 0  # Correct responses in a row if positive, wrong ones if negative
+        self.direction = 0
+        self.reversals = []
+
+    @property
+    def value(self):
+        return float(self.grid[self.index])
+
+    @property
+    def finished(self):
+        return len(self.reversals) >= self.max_reversals
+
+    def _after(self, correct):
+        """(index, run, direction) after a response"""
+        run = max(self.run, 0) + 1 if correct else min(self.run, 0) - 1
+        if run >= self.down:
+            direction, run = -self.easier, 0
+        elif -run >= self.up:
+            direction, run = self.easier, 0
+        else:
+            return self.index, run, self.direction
+        index = min(max(self.index + direction * self.step, 0), len(self.grid) - 1)
+        return index, run, direction
+
+    def update(self, correct):
+        index, self.run, direction = self._after(correct)
+        if self.direction and direction != self.direction:
+            self.reversals.append(self.value)
+        self.index, self.direction = index, direction
+
+    def candidates(self):
+        """Values of the next trial after a correct and after a wrong response"""
+        return [float(self.grid[self._after(correct)[0]]) for correct in (True, False)]
+
+    def estimate(self):
+        last = self.reversals[-6:]
+        return {"threshold": float(np.mean(last)) if last else None, "reversals": len(self.reversals)}
+
+
+class Quest:
+    """QUEST: Bayesian estimate of the threshold over a value grid.
+
+    The psychometric function is a logistic of (value - threshold) * slope,
+    scaled between the guess rate and 1 - lapse. Each trial is placed at the
+    grid value nearest the posterior mean.
+    """
+
+    def __init__(self, grid, start, prior_sd=None, slope=1.0, guess=0.5, lapse=0.02, easier=1):
+        self.grid = grid
+        self.slope, self.guess, self.lapse, self.easier = slope, guess, lapse, easier
+        prior_sd = prior_sd or (grid[-1] - grid[0]) / 2 or 1.0
+        self.log_posterior = -0.5 * ((grid - start) / prior_sd) ** 2
+        self.finished = False
+
+    def _p_correct(self, value):
+        """Probability of a correct response at value for every threshold of the grid"""
+        scaled = np.clip(self.easier * self.slope * (value - self.grid), -50, 50)
+        return self.guess + (1 - self.guess - self.lapse) / (1 + np.exp(-scaled))
+
+    def _mean(self, log_posterior):
+        weights = np.exp(log_posterior - log_posterior.max())
+        weights /= weights.sum()
+        mean = float(weights @ self.grid)
+        return mean, math.sqrt(max(float(weights @ (self.grid - mean) ** 2), 0.0))
+
+    def _choose(self, log_posterior):
+        return float(self.grid[np.abs(self.grid - self._mean(log_posterior)[0]).argmin()])
+
+    @property
+    def value(self):
+        return self._choose(self.log_posterior)
+
+    def _after(self, correct):
+        p = self._p_correct(self.value)
+        return self.log_posterior + np.log(p if correct else 1 - p)
+
+    def update(self, correct):
+        self.log_posterior = self._after(correct)
+
+    def candidates(self):
+        return [self._choose(self._after(correct)) for correct in (True, False)]
+
+    def estimate(self):
+        mean, sd = self._mean(self.log_posterior)
+        return {"threshold": mean, "sd": sd}
+
+
+class StimulusStore:
+    """Encoded stimuli in memory, rendered on request or ahead of time in a background thread"""
+
+    def __init__(self, size=DEFAULT_SIZE, max_entries=MAX_STIMULI, compress_level=3):
+        self.size = tuple(size)
+        self.max_entries = max_entries
+        self.compress_level = compress_level
+        self.images = OrderedDict()
+        self.specs = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "rendered": 0, "prefetched": 0}
+        # One rasterizer per thread that renders, as they keep the last geometry
+        self._rasterizer = IllusionRasterizer(self.size)
+        self._render_lock = threading.Lock()
+        self._prefetch_rasterizer = IllusionRasterizer(self.size)
+        self._executor = ThreadPoolExecutor(1)
+
+    def register(self, spec):
+        """Key of a spec, which /stimuli/<key>.png then serves"""
+        key = cache_key(*spec.canonical_args(self.size))
+        with self.lock:
+            self.specs[key] = spec
+        return key
+
+    def _encode(self, spec, rasterizer):
+        return encode_png(rasterizer.render_spec(spec), self.compress_level)
+
+    def _store(self, key, image):
+        with self.lock:
+            self.images[key] = image
+            self.images.move_to_end(key)
+            while len(self.images) > self.max_entries:
+                self.images.popitem(last=False)
+            self.pending.pop(key, None)
+
+    def _prefetch_job(self, key, spec):
+        if key not in self.images:
+            self._store(key, self._encode(spec, self._prefetch_rasterizer))
+            with self.lock:
+                self.stats["prefetched"] += 1
+
+    def prefetch(self, specs):
+        """Render specs in the background, in order, unless they are cached. Returns their keys."""
+        keys = []
+        for spec in specs:
+            key = self.register(spec)
+            keys.append(key)
+            with self.lock:
+                if key not in self.images and key not in self.pending:
+                    self.pending[key] = self._executor.submit(self._prefetch_job, key, spec)
+        return keys
+
+    def get(self, key):
+        """PNG bytes of a registered stimulus, rendering it now if needed. None if the key is unknown."""
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+                self.stats["hits"] += 1
+                return image
+            spec = self.specs.get(key)
+            future = self.pending.get(key)
+        if spec is None:
+            return None
+        if future is not None and not future.cancel():
+            # Already being rendered in the background
+            future.result()
+            return self.get(key)
+        with self._render_lock:
+            image = self._encode(spec, self._rasterizer)
+        self._store(key, image)
+        with self.lock:
+            self.stats["rendered"] += 1
+        return image
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Session:
+    """One run of an adaptive procedure, created from the JSON settings described in the module docstring"""
+
+    def __init__(self, settings, store, warm_grid=False):
+        self.settings = settings
+        self.store = store
+        self.parameter = settings.get("parameter", "shift_angle")
+        if self.parameter not in PARAMETERS:
+            raise ValueError(f"Unknown parameter {self.parameter}, expected one of {', '.join(PARAMETERS)}")
+        try:
+            self.grid = value_grid(float(settings["low"]), float(settings["high"]), float(settings["step"]))
+        except KeyError as e:
+            raise ValueError(f"Missing setting {e}")
+        self.project = dict(DEFAULT_PROJECT, **settings.get("project", {}))
+        self.answer = settings.get("answer")
+        self.max_trials = int(settings.get("max_trials", 40))
+        easier = {"higher": 1, "lower": -1}.get(settings.get("easier", "higher"))
+        if easier is None:
+            raise ValueError("easier must be \"higher\" or \"lower\"")
+        start = float(settings.get("start", self.grid[-1] if easier > 0 else self.grid[0]))
+
+        method = settings.get("method", "staircase")
+        if method == "staircase":
+            self.procedure = Staircase(self.grid, start, int(settings.get("up", 1)), int(settings.get("down", 2)),
+                                       int(settings.get("step_size", 1)), easier,
+                                       int(settings.get("max_reversals", 12)))
+        elif method == "quest":
+            self.procedure = Quest(self.grid, start, settings.get("prior_sd"), float(settings.get("slope", 1.0)),
+                                   float(settings.get("guess", 0.5)), float(settings.get("lapse", 0.02)), easier)
+        else:
+            raise ValueError(f"Unknown method {method}, expected one of {', '.join(METHODS)}")
+        self.method = method
+        self.id = uuid.uuid4().hex[:12]
+        self.responses = []
+        self.lock = threading.Lock()
+        # Every value the procedure can reach must give a valid spec, so a response never fails halfway
+        self.specs = {}
+        for value in self.grid.tolist():
+            try:
+                self.specs[value] = IllusionSpec.from_params(parameter_params(self.project, self.parameter, value))
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"{self.parameter} = {value:g} is not a valid setting: {e}")
+        # A procedure over values that give the same image would report a threshold for a stimulus that never changes
+        if len(set(self.specs.values())) < len(self.specs):
+            raise ValueError(f"Different {self.parameter} values of the grid give the same stimulus; use a coarser "
+                             f"grid, or a project whose colors {self.parameter} changes")
+        self._prepare()
+        if warm_grid:
+            store.prefetch(self.specs.values())
+
+    @property
+    def finished(self):
+        return self.procedure.finished or len(self.responses) >= self.max_trials
+
+    def spec(self, value):
+        return self.specs[value]
+
+    def _prepare(self):
+        """Queue the current stimulus and the candidates for the next trial"""
+        if self.finished:
+            self.key = None
+            return
+        self.key = self.store.prefetch([self.spec(self.procedure.value)])[0]
+        self.store.prefetch(self.spec(value) for value in self.procedure.candidates())
+
+    def trial(self):
+        """The current trial as a JSON-ready dict"""
+        if self.finished:
+            return {"session": self.id, "finished": True, "estimate": self.procedure.estimate()}
+        return {"session": self.id, "finished": False, "trial": len(self.responses),
+                "parameter": self.parameter, "value": self.procedure.value, "stimulus": f"/stimuli/{self.key}.png"}
+
+    def respond(self, payload):
+        """Record the response to the current trial and move on. Returns the next trial."""
+        with self.lock:
+            if self.finished:
+                raise ValueError("The session is finished")
+            if payload.get("trial", len(self.responses)) != len(self.responses):
+                raise ValueError(f"Expected a response to trial {len(self.responses)}")
+            if "correct" in payload:
+                correct = bool(payload["correct"])
+            elif self.answer is not None and "response" in payload:
+                correct = payload["response"] == self.answer
+            else:
+                raise ValueError("Expected \"correct\", or \"response\" with an answer set for the session")
+            self.responses.append({"value": self.procedure.value, "response": payload.get("response"),
+                                   "correct": correct, "time": time.time()})
+            self.procedure.update(correct)
+            self._prepare()
+            return self.trial()
+
+    def state(self):
+        return {"session": self.id, "method": self.method, "settings": self.settings, "finished": self.finished,
+                "responses": self.responses, "estimate": self.procedure.estimate()}
+
+
+class AdaptiveHandler(BaseHTTPRequestHandler):
+    """Routes of the adaptive server, see the module docstring"""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="application/json", cache=False):
+        if content_type == "application/json":
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        # The experiment page is usually served from elsewhere
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if cache:
+            # Stimuli are addressed by their parameters, so they never change
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"error": message})
+
+    def _json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ValueError("The request body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise ValueError("Expected a JSON object")
+        return payload
+
+    def _session(self, session_id):
+        return self.server.sessions.get(session_id)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self):
+        match = re.fullmatch(r"/stimuli/([0-9a-f]{64})\.png", self.path)
+        if match:
+            image = self.server.store.get(match.group(1))
+            if image is None:
+                return self._error(404, "Unknown stimulus")
+            return self._send(200, image, "image/png", cache=True)
+        match = re.fullmatch(r"/sessions/(\w+)", self.path)
+        if match and self._session(match.group(1)):
+            return self._send(200, self._session(match.group(1)).state())
+        if self.path == "/stats":
+            return self._send(200, dict(self.server.store.stats, sessions=len(self.server.sessions)))
+        self._error(404, "Not found")
+
+    def do_POST(self):
+        try:
+            if self.path == "/sessions":
+                session = Session(self._json(), self.server.store, self.server.warm_grid)
+                self.server.sessions[session.id] = session
+                return self._send(201, session.trial())
+            match = re.fullmatch(r"/sessions/(\w+)/responses", self.path)
+            if match and self._session(match.group(1)):
+                return self._send(200, self._session(match.group(1)).respond(self._json()))
+        except (KeyError, TypeError, ValueError) as e:
+            return self._error(400, str(e))
+        self._error(404, "Not found")
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, size=DEFAULT_SIZE, warm_grid=False, verbose=False):
+    """ThreadingHTTPServer for the adaptive API; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), AdaptiveHandler)
+    server.daemon_threads = True
+    server.store = StimulusStore(size)
+    server.sessions = {}
+    server.warm_grid = warm_grid
+    server.verbose = verbose
+    return server
+
+
+def _request(url, payload=None):
+    data = None if payload is None else json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(url, data, {"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+        return json.loads(body) if response.headers.get_content_type() == "application/json" else body
+
+
+def simulate(base_url, settings, threshold, noise=1.0, seed=None, think_time=0.0):
+    """Run a session against a simulated observer over HTTP, like an experiment page would.
+
+    The observer answers correctly with a probability that rises logistically
+    around threshold (with the given spread), from chance (50%) to 98%.
+    Returns (final state, latencies in seconds from sending a response to
+    having the next image).
+    """
+    rng = np.random.default_rng(seed)
+    easier = 1 if settings.get("easier", "higher") == "higher" else -1
+    trial = _request(f"{base_url}/sessions", settings)
+    _request(base_url + trial["stimulus"])
+    latencies = []
+    while not trial["finished"]:
+        p_correct = 0.5 + 0.48 / (1 + math.exp(-easier * (trial["value"] - threshold) / noise))
+        correct = bool(rng.random() < p_correct)
+        # A participant looks at the stimulus before answering
+        time.sleep(think_time)
+        start = time.perf_counter()
+        trial = _request(f"{base_url}/sessions/{trial['session']}/responses",
+                         {"trial": trial["trial"], "correct": correct})
+        if not trial["finished"]:
+            _request(base_url + trial["stimulus"])
+            latencies.append(time.perf_counter() - start)
+    return _request(f"{base_url}/sessions/{trial['session']}"), latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Adaptive stimulus server rendering on demand")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Run the HTTP server")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    serve_parser.add_argument("--warm-grid", action="store_true",
+                              help="Render every grid value of a new session in the background")
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request")
+    simulate_parser = commands.add_parser("simulate", help="Run a session against a simulated observer")
+    simulate_parser.add_argument("settings", help="Session settings JSON file")
+    simulate_parser.add_argument("--threshold", type=float, required=True, help="Threshold of the observer")
+    simulate_parser.add_argument("--noise", type=float, default=1.0, help="Spread of the observer's responses")
+    simulate_parser.add_argument("--think", type=float, default=0.3,
+                                 help="Seconds the observer takes per trial (default: 0.3)")
+    simulate_parser.add_argument("--seed", type=int, help="Random seed of the observer")
+    simulate_parser.add_argument("--url", help="Use a running server instead of starting one")
+    for command_parser in (serve_parser, simulate_parser):
+        command_parser.add_argument("--size", type=int, nargs=2, default=list(DEFAULT_SIZE),
+                                    metavar=("WIDTH", "HEIGHT"), help="Stimulus size in pixels")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            server = make_server(args.host, args.port, args.size, args.warm_grid, args.verbose)
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        print(f"Serving on http://{args.host}:{server.server_address[1]}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.store.close()
+        return 0
+
+    try:
+        with open(args.settings, 'r') as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = make_server(port=0, size=args.size)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        state, latencies = simulate(base_url.rstrip('/'), settings, args.threshold, args.noise, args.seed,
+                                    args.think)
+    except urllib.error.HTTPError as e:
+        print(f"Error: {e.code} {json.loads(e.read()).get('error', e.reason)}", file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            server.store.close()
+
+    print(f"{len(state['responses'])} trials, estimate {json.dumps(state['estimate'])} "
+          f"(observer threshold {args.threshold:g})")
+    if latencies:
+        milliseconds = np.array(latencies) * 1000
+        print(f"Next stimulus latency: median {np.median(milliseconds):.1f} ms, "
+              f"95th percentile {np.percentile(milliseconds, 95):.1f} ms, max {milliseconds.max():.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
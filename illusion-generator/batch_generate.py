@@ -0,0 +1,319 @@
+"""Headless batch generation of Snake Illusion stimuli from a parameter sweep.
+
+Usage:
+    python batch_generate.py sweep.json --output-dir stimuli
+
+The sweep file is a JSON object mapping each parameter to a list of options,
+for example:
+
+    {
+      "colors": [["#000000", "#B0B0B0", "#FFFFFF", "#707070"]],
+      "saturations": [[0, 0, 0, 0]],
+      "widths": [[1.0, 1.0, 1.0, 1.0], [1.0, 2.0, 1.0, 2.0]],
+      "num_patterns": [12, 24],
+      "shift_angle": [-12.5, 12.5],
+      "background": ["#808080", "transparent"],
+      "pattern_type": ["reversed", "classic"]
+    }
+
+Very large sweeps can be stored as a spec table instead (see spec_table.py)
+and passed as a .npy file in place of the JSON sweep.
+
+Every combination is written as a PNG using the same filename format as
+"Save Illusion" in the GUI. Stimuli are rendered and written one at a time,
+so memory use does not grow with the size of the sweep.
+
+Use --workers to render on several processes. Each worker renders and writes
+its own files, and only a few jobs per worker are queued at any time.
+Failed stimuli are reported individually and do not stop the sweep.
+
+PNG files are encoded directly from the rendered pixels (see png_export.py),
+with --compress-level trading file size for speed, and carry their render
+parameters in a "Parameters" text chunk.
+
+--size renders any pixel size and --supersample N anti-aliases the wedge
+edges with N x N samples per pixel. Large or supersampled images are
+rendered and written in tiles, so memory stays bounded for 4K and 8K output.
+
+Each written stimulus is recorded in manifest.sqlite in the output directory
+(see stimulus_manifest.py), with its file hash and full parameters.
+
+Finished stimuli are recorded in a job ledger (see sweep_ledger.py), so
+running an interrupted sweep again skips every stimulus that is already
+written with the same parameters and only renders changed or missing ones.
+Progress lines show the measured throughput and the time left.
+
+Rendered files are stored in the render cache (see render_cache.py), and
+stimuli already in the cache at the same --compress-level are copied instead
+of rendered again.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+
+from illusion_renderer import DEFAULT_SIZE, is_tiled, polar_maps, render_spec, render_spec_rows
+from illusion_spec import IllusionSpec, expand_sweep, params_filename, sweep_size
+from png_export import params_text, write_png_rows
+from render_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, RenderCache, canonical_params, cache_key
+from spec_table import iter_params, load_table
+from stimulus_manifest import MANIFEST_NAME, StimulusManifest
+from sweep_ledger import LEDGER_NAME, JobLedger, Progress
+
+# Render cache and output options of the current process, set up by _init_worker
+_cache = None
+_compress_level = 6
+_size = DEFAULT_SIZE
+_supersample = 1
+
+
+def render_params(params, size=DEFAULT_SIZE, supersample=1):
+    """Render the full illusion described by a project dict"""
+    return render_spec(IllusionSpec.from_params(params), size, supersample)
+
+
+def load_sweep(path):
+    """Load a sweep JSON file, or a spec table written by spec_table.py"""
+    if path.endswith(".npy"):
+        return load_table(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def sweep_params(sweep):
+    """Lazily yield the project dicts of a sweep spec or a spec table"""
+    return expand_sweep(sweep) if isinstance(sweep, dict) else iter_params(sweep)
+
+
+def sweep_count(sweep):
+    """Number of project dicts sweep_params yields"""
+    return sweep_size(sweep) if isinstance(sweep, dict) else len(sweep)
+
+
+def params_cache_key(params, size=DEFAULT_SIZE, supersample=1):
+    """Render cache key of a project dict"""
+    return cache_key(*IllusionSpec.from_params(params).canonical_args(size, 100, supersample))
+
+
+def _init_worker(cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES, compress_level=6, size=DEFAULT_SIZE,
+                 supersample=1):
+    """Open the render cache and build the polar maps once per worker process"""
+    global _cache, _compress_level, _size, _supersample
+    _cache = RenderCache(cache_dir, cache_max_bytes) if cache_dir else None
+    _compress_level = compress_level
+    _size = tuple(size)
+    _supersample = supersample
+    if not is_tiled(_size, _supersample):
+        polar_maps(_size)
+
+
+def _render_job(job):
+    """Render and write one stimulus.
+
+    Returns (params, file_path, cache key, saturated colors, error message or
+    None); the key and colors are None when the parameters are invalid.
+    """
+    params, file_path = job
+    key = colors = None
+    try:
+        spec = IllusionSpec.from_params(params)
+        render_args = spec.canonical_args(_size, 100, _supersample)
+        key, colors = cache_key(*render_args), spec.colors
+        if _cache is None or not _cache.get(key, file_path, _compress_level):
+            rows = render_spec_rows(spec, _size, _supersample)
+            write_png_rows(file_path, _size, rows, _compress_level, params_text(canonical_params(*render_args)))
+            if _cache is not None:
+                _cache.put(key, file_path, _compress_level)
+    except Exception as e:
+        return params, file_path, key, colors, f"{type(e).__name__}: {e}"
+    return params, file_path, key, colors, None
+
+
+def _skipped_result(job):
+    """_render_job result of a point that is not rendered again"""
+    return job + (None, None, None)
+
+
+def _run_parallel(jobs, workers, ordered, cache_args):
+    """Run jobs on a process pool, keeping at most a few jobs per worker in flight"""
+    # Imported here because the process pool adds ~35 ms to every start, and
+    # single-process runs and the workers themselves never need it
+    from concurrent.futures import Future, ProcessPoolExecutor
+
+    max_pending = workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=cache_args) as executor:
+        pending = deque()
+        for job in jobs:
+            if job[0] is None:
+                # A skipped point takes its place in the queue as an already finished job
+                future = Future()
+                future.set_result(_skipped_result(job))
+                pending.append(future)
+            else:
+                pending.append(executor.submit(_render_job, job))
+            while len(pending) >= max_pending:
+                yield from _collect(pending, ordered)
+        while pending:
+            yield from _collect(pending, ordered)
+
+
+def _collect(pending, ordered):
+    """Wait for the next result (ordered) or any finished results (unordered)"""
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    if ordered:
+        yield pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def generate_sweep(sweep, output_dir, dry_run=False, workers=1, ordered=True,
+                   cache_dir=DEFAULT_CACHE_DIR, cache_max_bytes=DEFAULT_MAX_BYTES, compress_level=6,
+                   size=DEFAULT_SIZE, supersample=1, manifest=None, ledger=None, resume=True):
+    """Render every combination of a sweep, a sweep spec dict or a spec table.
+
+    Yields (file_path, error, skipped) as each stimulus is written, where error
+    is None on success. With workers > 1 the stimuli are rendered on a process
+    pool and, unless ordered is True, yielded in completion order. Pass
+    cache_dir=None to bypass the render cache. compress_level is the zlib level
+    (0-9) of the PNG files, size the output (width, height) in pixels and
+    supersample the samples per pixel along each axis. Written stimuli are
+    recorded in manifest, a StimulusManifest, unless it is None.
+
+    Every result is recorded in ledger, a JobLedger, unless it is None. With
+    resume, stimuli the ledger records as done for the same parameters are
+    skipped (yielded with skipped True).
+    """
+    def jobs():
+        # Points the ledger records as done are passed on as jobs without params,
+        # so they are reported in sweep order while the rest are rendered
+        for params in sweep_params(sweep):
+            file_path = os.path.join(output_dir, params_filename(params))
+            if resume and ledger is not None and ledger.is_done(file_path,
+                                                                params_cache_key(params, size, supersample)):
+                yield None, file_path
+            else:
+                yield params, file_path
+
+    if dry_run:
+        for params, file_path in jobs():
+            yield file_path, None, params is None
+        return
+
+    cache_args = (cache_dir, cache_max_bytes, compress_level, size, supersample)
+    if workers > 1:
+        results = _run_parallel(jobs(), workers, ordered, cache_args)
+    else:
+        _init_worker(*cache_args)
+        results = (_skipped_result(job) if job[0] is None else _render_job(job) for job in jobs())
+    for params, file_path, key, colors, error in results:
+        if params is None:
+            yield file_path, None, True
+        elif error is None:
+            if manifest is not None:
+                manifest.add(params, file_path, key, colors)
+            if ledger is not None:
+                ledger.mark_done(file_path, key)
+            yield file_path, None, False
+        else:
+            if ledger is not None:
+                ledger.mark_failed(file_path, key, error)
+            yield file_path, error, False
+
+
+def parse_size(value):
+    """Parse a WIDTHxHEIGHT pixel size"""
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {value!r}")
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"Size must be positive, got {value!r}")
+    return width, height
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Snake Illusion stimuli from a parameter sweep")
+    parser.add_argument("sweep", help="JSON file describing the parameter sweep, or a .npy spec table")
+    parser.add_argument("-o", "--output-dir", default=".", help="Directory for the generated PNG files")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the filenames that would be written")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of worker processes (0 uses every CPU core)")
+    parser.add_argument("--unordered", action="store_true",
+                        help="Report stimuli as they finish instead of in sweep order")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Render cache directory")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                        help="Render cache size limit in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, without using the cache")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="PNG compression level, lower is faster and larger (default: 6)")
+    parser.add_argument("--manifest",
+                        help=f"Stimulus manifest file (default: {MANIFEST_NAME} in the output directory)")
+    parser.add_argument("--no-manifest", action="store_true", help="Do not record the stimuli in a manifest")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Render every stimulus, even those a previous run already wrote")
+    parser.add_argument("--size", type=parse_size, default=DEFAULT_SIZE, metavar="WIDTHxHEIGHT",
+                        help="Output size in pixels (default: 739x462, the GUI save size)")
+    parser.add_argument("--supersample", type=int, default=1, metavar="N",
+                        help="Average N x N samples per pixel to anti-alias the wedge edges")
+    args = parser.parse_args(argv)
+
+    try:
+        sweep = load_sweep(args.sweep)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if not args.dry_run:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.supersample < 1:
+        parser.error("--supersample must be at least 1")
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    manifest = None
+    if not args.dry_run and not args.no_manifest:
+        manifest = StimulusManifest(args.manifest or os.path.join(args.output_dir, MANIFEST_NAME))
+    # The ledger is kept up to date even with --no-resume, so a later run can resume
+    ledger_path = os.path.join(args.output_dir, LEDGER_NAME)
+    ledger = None
+    if not args.dry_run or os.path.exists(ledger_path):
+        ledger = JobLedger(ledger_path)
+    progress = Progress(sweep_count(sweep))
+    failed = 0
+    skipped = 0
+    try:
+        for file_path, error, was_skipped in generate_sweep(
+                sweep, args.output_dir, args.dry_run, workers, not args.unordered,
+                None if args.no_cache else args.cache_dir, int(args.cache_size * 1024 ** 2), args.compress_level,
+                args.size, args.supersample, manifest, ledger, not args.no_resume):
+            progress.update(was_skipped)
+            if was_skipped:
+                skipped += 1
+                print(f"{progress.format()} Unchanged: {file_path}")
+            elif error is None:
+                print(f"{progress.format()} {file_path}")
+            else:
+                failed += 1
+                print(f"{progress.format()} Failed: {file_path}: {error}", file=sys.stderr)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if ledger is not None:
+            ledger.close()
+
+    print(f"Generated {progress.done - failed - skipped} stimuli in {args.output_dir}"
+          + (f", {skipped} unchanged stimuli skipped" if skipped else ""))
+    if failed:
+        print(f"{failed} stimuli failed", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""Render benchmarks for the Snake Illusion Generator.
+
+Usage:
+    python benchmark.py [--repeat 20] [--quick] [--history benchmark_history.jsonl]
+
+Runs headless: the application window is created with the offscreen Qt
+platform, so generate_full_illusion and generate_preview are measured
+exactly as the GUI runs them. The save path is measured as the GUI and batch
+runs take it, render_spec output written by png_export. The cases sweep the
+number of patterns, 3 vs 4 colors, classic vs reversed patterns, the output
+resolution and the PNG compress level. Each case reports latency
+percentiles, images per second and the peak RSS of the process so far.
+
+Every run is appended as one JSON line to the history file and compared with
+the previous run, so slowdowns in the render path show up before a large
+stimulus run. The cold import time of the headless modules is measured too,
+and a warning is printed if any of them loads Qt or matplotlib.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from illusion_colors import set_color_saturation, set_color_saturations
+from illusion_renderer import DEFAULT_SIZE, render_full_illusion, render_spec, render_spec_rows
+from illusion_spec import IllusionSpec
+from png_export import encode_png, write_png, write_png_rows
+
+# Modules that batch workers and other headless tools import. They must not
+# pull in Qt or pyplot, which only the GUI needs.
+CORE_MODULES = ["illusion_colors", "illusion_renderer", "illusion_spec", "png_export", "render_cache",
+                "batch_generate"]
+GUI_MODULES = ("PyQt5", "matplotlib")
+
+FOUR_COLORS = ["#000000", "#B0B0B0", "#FFFFFF", "#707070"]
+THREE_COLORS = ["#FF0000", "#00FF00", "#0000FF"]
+BACKGROUND = "#808080"
+SHIFT_ANGLE = -12.5
+# Output resolutions of the save_size case: the GUI size, twice that and 4K
+OUTPUT_SIZES = [DEFAULT_SIZE, (2 * DEFAULT_SIZE[0], 2 * DEFAULT_SIZE[1]), (3840, 2160)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(name, func, repeat, warmup=1, **case):
+    """Time func() repeat times and summarize the latencies"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    result = {
+        "name": name,
+        "case": case,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "images_per_sec": float(1000 / latencies.mean()),
+        "peak_rss_mb": peak_rss_mb()
+    }
+    case_str = ' '.join(f"{k}={v}" for k, v in case.items())
+    rss_str = "n/a" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:.0f} MB"
+    print(f"{name:<22} {case_str:<42} p50 {result['p50_ms']:8.2f} ms  p90 {result['p90_ms']:8.2f} ms  "
+          f"p99 {result['p99_ms']:8.2f} ms  {result['images_per_sec']:8.1f}/s  peak RSS {rss_str}")
+    return result
+
+
+def import_times(module):
+    """Import a module in a fresh interpreter and return ({module: cumulative ms}, GUI modules loaded)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=here,
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative) / 1000
+    gui_modules = sorted(name for name in times if name.split('.')[0] in GUI_MODULES)
+    return times, gui_modules
+
+
+def measure_imports(repeat):
+    """Cold import time of each core module, which every short-lived batch job pays"""
+    results = []
+    for module in CORE_MODULES:
+        latencies = []
+        gui_modules = []
+        for _ in range(repeat):
+            times, gui_modules = import_times(module)
+            latencies.append(times[module])
+        latencies = np.array(latencies)
+        result = {
+            "name": "import",
+            "case": {"module": module},
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "images_per_sec": None,
+            "peak_rss_mb": None,
+            "gui_modules": gui_modules
+        }
+        warning = f"  WARNING: imports {', '.join(gui_modules)}" if gui_modules else ""
+        print(f"{'import':<22} {'module=' + module:<42} p50 {result['p50_ms']:8.2f} ms  "
+              f"p90 {result['p90_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms{warning}")
+        results.append(result)
+    return results
+
+
+def load_app():
+    """Create the application window on the offscreen Qt platform, or return None without PyQt5"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        print("PyQt5 is not installed, skipping the GUI benchmarks")
+        return None, None
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location("snake_illusion_generator",
+                                                  os.path.join(here, "snake-illusion-generator.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    return app, module.SnakeIllusionApp()
+
+
+def illusion_cases(pattern_counts):
+    """Yield (num_patterns, colors, use_classic_pattern) for every full-illusion case"""
+    for num_patterns in pattern_counts:
+        for colors in (THREE_COLORS, FOUR_COLORS):
+            for use_classic_pattern in (False, True):
+                # Classic patterns need 4 colors
+                if use_classic_pattern and len(colors) != 4:
+                    continue
+                yield num_patterns, colors, use_classic_pattern
+
+
+def run_benchmarks(repeat, pattern_counts, compress_levels, sizes=(DEFAULT_SIZE,), use_gui=True):
+    import tempfile
+
+    results = measure_imports(max(1, repeat // 4))
+    app, window = load_app() if use_gui else (None, None)
+    plt = None
+    if window is not None:
+        import matplotlib.pyplot as plt
+
+    for num_patterns, colors, use_classic_pattern in illusion_cases(pattern_counts):
+        widths = [1.0] * len(colors)
+        case = {"num_patterns": num_patterns, "num_colors": len(colors),
+                "pattern": "classic" if use_classic_pattern else "reversed"}
+
+        results.append(measure("render_full_illusion", lambda: render_full_illusion(
+            widths, num_patterns, colors, BACKGROUND, SHIFT_ANGLE, use_classic_pattern), repeat, **case))
+
+        if window is not None:
+            window.use_classic_pattern = use_classic_pattern
+
+            def full_illusion():
+                plt.close(window.generate_full_illusion(widths, num_patterns, colors, BACKGROUND, SHIFT_ANGLE))
+            results.append(measure("generate_full_illusion", full_illusion, repeat, **case))
+
+    if window is not None:
+        for colors in (THREE_COLORS, FOUR_COLORS):
+            window.num_colors = len(colors)
+            widths = [1.0] * len(colors)
+
+            def preview():
+                plt.close(window.generate_preview(widths, 24, colors, BACKGROUND, SHIFT_ANGLE))
+            results.append(measure("generate_preview", preview, repeat, num_colors=len(colors)))
+        window.num_colors = 4
+
+    # Save path: the GUI writes the render_spec raster, batch workers stream its row blocks,
+    # and encode_png alone shows the share of the zlib level
+    spec = IllusionSpec(FOUR_COLORS, [1.0] * 4, 24, SHIFT_ANGLE, BACKGROUND)
+    image = render_spec(spec)
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, "benchmark.png")
+        for compress_level in compress_levels:
+            case = {"compress_level": compress_level}
+            results.append(measure("encode_png", lambda: encode_png(image, compress_level), repeat, **case))
+            results.append(measure("save_illusion", lambda: write_png(file_path, render_spec(spec), compress_level),
+                                   repeat, **case))
+            results.append(measure("batch_save", lambda: write_png_rows(
+                file_path, DEFAULT_SIZE, render_spec_rows(spec), compress_level), repeat, **case))
+
+        # Output resolution: the same save at larger sizes, which scale with the pixel count
+        for size in sizes:
+            results.append(measure("save_size", lambda: write_png(file_path, render_spec(spec, size)), repeat,
+                                   size=f"{size[0]}x{size[1]}"))
+
+    # Color helpers, per color and for a 101-step saturation grid
+    results.append(measure("set_color_saturation", lambda: [set_color_saturation(c, 50) for c in THREE_COLORS],
+                           repeat, colors=len(THREE_COLORS)))
+    saturation_grid = np.repeat(np.arange(101)[:, None], len(THREE_COLORS), axis=1)
+    results.append(measure("set_color_saturations", lambda: set_color_saturations(THREE_COLORS, saturation_grid),
+                           repeat, colors=saturation_grid.size))
+
+    if window is not None:
+        window.close()
+    return results
+
+
+def git_commit():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_last_run(history_path):
+    if not os.path.exists(history_path):
+        return None
+    last = None
+    with open(history_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def compare_runs(previous, results, threshold):
+    """Print p50 changes against the previous run and return the cases that slowed down"""
+    previous_p50 = {(r["name"], json.dumps(r["case"], sort_keys=True)): r["p50_ms"] for r in previous["results"]}
+    regressions = []
+    for result in results:
+        before = previous_p50.get((result["name"], json.dumps(result["case"], sort_keys=True)))
+        if not before:
+            continue
+        change = result["p50_ms"] / before - 1
+        if change > threshold:
+            regressions.append((result, before, change))
+
+    print(f"\nCompared with run of {previous['date']} ({previous.get('commit') or 'unknown commit'}):")
+    if not regressions:
+        print(f"No case slowed down by more than {threshold:.0%}")
+    for result, before, change in regressions:
+        case_str = ' '.join(f"{k}={v}" for k, v in result["case"].items())
+        print(f"  SLOWER {result['name']} {case_str}: {before:.2f} -> {result['p50_ms']:.2f} ms ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Snake Illusion render path")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per case")
+    parser.add_argument("--quick", action="store_true", help="Fewer pattern counts, compress levels and output sizes")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the benchmarks that need the Qt window")
+    parser.add_argument("--history", default="benchmark_history.jsonl", help="JSON lines file of past runs")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative p50 slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 if any case regressed")
+    args = parser.parse_args(argv)
+
+    pattern_counts = [1, 24, 50] if args.quick else [1, 5, 10, 24, 36, 50]
+    compress_levels = [6] if args.quick else [1, 6, 9]
+    sizes = [DEFAULT_SIZE] if args.quick else OUTPUT_SIZES
+
+    results = run_benchmarks(args.repeat, pattern_counts, compress_levels, sizes, use_gui=not args.no_gui)
+    run = {
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results
+    }
+
+    previous = load_last_run(args.history)
+    regressions = compare_runs(previous, results, args.threshold) if previous else []
+
+    with open(args.history, 'a') as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"Results appended to {args.history}")
+
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
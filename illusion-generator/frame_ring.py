@@ -0,0 +1,276 @@
+"""Shared-memory ring buffer of rendered RGBA frames.
+
+Usage:
+    python frame_ring.py publish sweep.json --name snake_frames --slots 16
+    python frame_ring.py read snake_frames
+
+A producer copies each rendered frame into a block of shared memory
+(multiprocessing.shared_memory), one memcpy per frame, so local consumers
+such as a display server, a video encoder or an image-statistics step read
+the pixels without PNG encoding, decoding or file I/O. The block holds a small header, one
+metadata entry per slot and the frames:
+
+    header  magic, version, width, height, channels, slots, frames written
+    slots   per slot: state, frame index, time written, render cache key
+    frames  slots x height x width x 4 uint8
+
+There is one writer. Frame i goes to slot i % slots, and the slot state is
+odd while the frame is being written, so a reader can tell a complete frame
+from one that is half overwritten. Readers that fall more than slots frames
+behind lose the oldest frames, and FrameRing.frames reports how many.
+
+illusion_animation.py writes its frames here with --format shm.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from illusion_renderer import DEFAULT_SIZE, render_spec
+from illusion_spec import IllusionSpec
+from render_cache import cache_key
+
+MAGIC = b"SNAKERNG"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIII4x")
+# Per-slot metadata: state, frame index, time written, raw sha256 render cache key
+SLOT_DTYPE = np.dtype([("state", np.uint64), ("index", np.uint64), ("time", np.float64), ("key", "S32")])
+ALIGNMENT = 64
+
+# Blocks created by this process, which the resource tracker must keep tracking
+_created = set()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _attach(name):
+    """Open an existing shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix" and shm._name not in _created:
+            # Older versions would remove the block when this reader exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class FrameRing:
+    """Fixed-size ring of RGBA frames in shared memory, see the module docstring for the layout"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, version, width, height, channels, slots = HEADER.unpack_from(shm.buf)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{shm.name} is not a frame ring")
+        self.size = (width, height)
+        self.slots = slots
+        # Total frames written, right after the header
+        self._count = np.ndarray((1,), np.uint64, shm.buf, HEADER.size)
+        slot_offset = _align(HEADER.size + 8)
+        self._meta = np.ndarray((slots,), SLOT_DTYPE, shm.buf, slot_offset)
+        frame_offset = _align(slot_offset + slots * SLOT_DTYPE.itemsize)
+        self._frames = np.ndarray((slots, height, width, channels), np.uint8, shm.buf, frame_offset)
+
+    @classmethod
+    def create(cls, name=None, size=DEFAULT_SIZE, slots=8):
+        """Create a new ring for frames of size (width, height). name=None picks a free name."""
+        width, height = size
+        if slots < 1:
+            raise ValueError("A frame ring needs at least one slot")
+        slot_offset = _align(HEADER.size + 8)
+        frame_offset = _align(slot_offset + slots * SLOT_DTYPE.itemsize)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=frame_offset + slots * height * width * 4)
+        _created.add(shm._name)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, width, height, 4, slots)
+        shm.buf[HEADER.size:frame_offset] = bytes(frame_offset - HEADER.size)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Open a ring created by another process"""
+        shm = _attach(name)
+        try:
+            return cls(shm, owner=False)
+        except Exception:
+            shm.close()
+            raise
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def count(self):
+        """Number of frames written so far"""
+        return int(self._count[0])
+
+    def write(self, image, key=None):
+        """Copy an RGBA image into the next slot and return its frame index.
+
+        key is an optional render cache key (64 hex digits) stored with the frame.
+        """
+        index = self.count
+        meta = self._meta[index % self.slots]
+        meta["state"] = 2 * index + 1
+        self._frames[index % self.slots] = image
+        meta["index"] = index
+        meta["time"] = time.time()
+        meta["key"] = bytes.fromhex(key) if key else b""
+        meta["state"] = 2 * index + 2
+        self._count[0] = index + 1
+        return index
+
+    def slot(self, index):
+        """Zero-copy view of frame index, valid until the writer wraps around to its slot.
+
+        Raises LookupError if the frame is not written yet or already overwritten.
+        """
+        if self._meta[index % self.slots]["state"] != 2 * index + 2:
+            raise LookupError(f"Frame {index} is not in the ring")
+        return self._frames[index % self.slots]
+
+    def read(self, index, out=None):
+        """Copy frame index out of the ring. Returns (image, metadata dict).
+
+        Raises LookupError if the frame is not in the ring or was overwritten
+        while it was copied.
+        """
+        view = self.slot(index)
+        meta = self._meta[index % self.slots].copy()
+        if out is None:
+            out = np.empty_like(view)
+        np.copyto(out, view)
+        if self._meta[index % self.slots]["state"] != 2 * index + 2:
+            raise LookupError(f"Frame {index} was overwritten while reading")
+        key = bytes(meta["key"])
+        return out, {"index": index, "time": float(meta["time"]), "key": key.hex() if key else None}
+
+    def frames(self, start=None, timeout=None, poll=0.001):
+        """Yield (image, metadata) for every new frame, waiting for the writer.
+
+        Starts at frame start (default: the next frame written). Frames that
+        were overwritten before they could be read are skipped, and the
+        metadata of the next frame counts them in "dropped". Stops after
+        timeout seconds without a new frame.
+        """
+        index = self.count if start is None else start
+        dropped = 0
+        last_frame = time.monotonic()
+        while True:
+            count = self.count
+            if index >= count:
+                if timeout is not None and time.monotonic() - last_frame > timeout:
+                    return
+                time.sleep(poll)
+                continue
+            if count - index > self.slots:
+                # Already overwritten
+                dropped += count - self.slots - index
+                index = count - self.slots
+            try:
+                image, meta = self.read(index)
+            except LookupError:
+                dropped += 1
+                index += 1
+                continue
+            meta["dropped"] = dropped
+            dropped = 0
+            last_frame = time.monotonic()
+            index += 1
+            yield image, meta
+
+    def close(self):
+        """Detach from the ring. The creating process also removes it."""
+        # The arrays are views of the buffer, which cannot be released while they exist
+        del self._count, self._meta, self._frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm._name)
+
+
+def stream(ring, frames, fps=None):
+    """Write (image, key) pairs to a ring, at most fps frames per second. Returns the number of frames."""
+    interval = 1.0 / fps if fps else 0.0
+    next_time = time.monotonic()
+    written = 0
+    for image, key in frames:
+        if interval:
+            time.sleep(max(0.0, next_time - time.monotonic()))
+            next_time += interval
+        ring.write(image, key)
+        written += 1
+    return written
+
+
+def publish(ring, specs, fps=None):
+    """Render IllusionSpecs into a ring, keyed by their render cache keys. Returns the number of frames."""
+    return stream(ring, ((render_spec(spec, ring.size), cache_key(*spec.canonical_args(ring.size)))
+                         for spec in specs), fps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream rendered illusions through shared memory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_parser = commands.add_parser("publish", help="Render a sweep into a new frame ring")
+    publish_parser.add_argument("sweep", help="Sweep JSON file or .npy spec table, see batch_generate.py")
+    publish_parser.add_argument("--name", help="Shared memory name (default: a free name, printed)")
+    publish_parser.add_argument("--slots", type=int, default=8, help="Frames kept in the ring")
+    publish_parser.add_argument("--fps", type=float, help="Limit the frame rate")
+    publish_parser.add_argument("--hold", type=float, default=5.0,
+                                help="Seconds to keep the ring after the last frame, for slow readers")
+    read_parser = commands.add_parser("read", help="Print the frames arriving in a ring")
+    read_parser.add_argument("name", help="Shared memory name")
+    read_parser.add_argument("--timeout", type=float, default=10.0, help="Stop after this many idle seconds")
+    args = parser.parse_args(argv)
+
+    if args.command == "publish":
+        # Imported here so readers do not pay for the sweep machinery
+        from batch_generate import load_sweep, sweep_params
+
+        try:
+            specs = (IllusionSpec.from_params(params) for params in sweep_params(load_sweep(args.sweep)))
+            ring = FrameRing.create(args.name, DEFAULT_SIZE, args.slots)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        try:
+            print(f"Publishing to {ring.name}", flush=True)
+            written = publish(ring, specs, args.fps)
+            print(f"{written} frames written to {ring.name}")
+            time.sleep(args.hold)
+        except (KeyError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        finally:
+            ring.close()
+        return 0
+
+    try:
+        ring = FrameRing.attach(args.name)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    try:
+        for image, meta in ring.frames(start=0, timeout=args.timeout):
+            mean = image[..., :3].mean(axis=(0, 1))
+            print(json.dumps({"index": meta["index"], "dropped": meta["dropped"], "key": meta["key"],
+                              "mean_rgb": [round(float(v), 2) for v in mean]}), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
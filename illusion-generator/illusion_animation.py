@@ -0,0 +1,205 @@
+"""Animated control stimuli built on the full illusion.
+
+Usage:
+    python illusion_animation.py project.json --mode rotate --frames 120 --step 1.5 -o rotate.gif
+
+Two kinds of real motion are supported, to calibrate the illusory motion
+against:
+
+    rotate   the discs turn by step degrees per frame (the startangle of
+             every ring advances), by default in opposite directions
+    flicker  frames alternate between the classic and the reversed pattern
+
+The pixel geometry is computed once and every frame is a palette lookup of
+a cached index map, so hundreds of frames take seconds. Frames are streamed
+to a GIF, an animated PNG or a directory of numbered PNG files, so memory
+does not grow with the number of frames. --format shm plays them at --fps
+into a shared-memory frame ring instead (see frame_ring.py).
+"""
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from illusion_renderer import DEFAULT_SIZE, START_ANGLE, apply_palette, illusion_index_map, illusion_palette
+from illusion_spec import params_background, params_colors
+from png_export import params_text, write_apng, write_png
+
+MODES = ["rotate", "flicker"]
+FORMATS = ["gif", "apng", "frames", "shm"]
+# Index maps kept in rotate mode, about 340 KB each at the default size
+MAX_INDEX_MAPS = 32
+
+
+def animation_frames(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                     use_classic_pattern=False, mode="rotate", num_frames=60, step=1.0, counter_rotate=True,
+                     size=DEFAULT_SIZE):
+    """Yield (index_map, palette) for every frame; apply_palette(palette, index_map) gives the RGBA frame.
+
+    In rotate mode frame i turns the left disc counterclockwise by i * step
+    degrees and the right disc the same amount clockwise (or also
+    counterclockwise without counter_rotate). In flicker mode even frames use
+    the reversed and odd frames the classic pattern, which needs 4 colors.
+    """
+    num_colors = len(left_colors)
+    transparent_center = background is None
+    if (mode == "flicker" or use_classic_pattern) and num_colors != 4:
+        raise ValueError("Classic patterns need exactly 4 colors")
+    if mode == "flicker":
+        phases = [(illusion_index_map(width_pattern, pattern_repeats, num_colors, shift_angle, classic,
+                                      transparent_center, size), illusion_palette(left_colors, background, classic))
+                  for classic in (False, True)]
+        for i in range(num_frames):
+            yield phases[i % 2]
+        return
+    if mode != "rotate":
+        raise ValueError(f"Unknown animation mode: {mode}")
+
+    # Turning a disc by one pattern period gives the same image, so index maps
+    # are cached by the rotation within one period. The cache is bounded, as a
+    # step that does not divide the period never repeats a rotation
+    period = 360.0 / pattern_repeats
+    palette = illusion_palette(left_colors, background, use_classic_pattern)
+    index_maps = OrderedDict()
+    for i in range(num_frames):
+        offset = round(float(np.mod(i * step, period)), 9)
+        right_offset = round(float(np.mod(-i * step, period)), 9) if counter_rotate else offset
+        key = (offset, right_offset)
+        if key in index_maps:
+            index_maps.move_to_end(key)
+        else:
+            index_maps[key] = illusion_index_map(width_pattern, pattern_repeats, num_colors, shift_angle,
+                                                 use_classic_pattern, transparent_center, size,
+                                                 (START_ANGLE + offset, START_ANGLE + right_offset))
+            if len(index_maps) > MAX_INDEX_MAPS:
+                index_maps.popitem(last=False)
+        yield index_maps[key], palette
+
+
+def write_gif(file_path, frames, delay_ms=40, loop=0):
+    """Stream (index_map, palette) frames to a GIF file.
+
+    GIF delays are stored in 1/100 s, so delay_ms is rounded to 10 ms. Fully
+    transparent palette entries become the GIF's transparent color.
+    """
+    # Pillow is installed with matplotlib; only the GIF writer needs it
+    from PIL import GifImagePlugin, Image
+
+    with open(file_path, 'wb') as f:
+        for i, (index_map, palette) in enumerate(frames):
+            params = {"duration": delay_ms, "include_color_table": True}
+            transparent = np.flatnonzero(palette[:, 3] == 0)
+            if len(transparent):
+                # A GIF has one transparent color, so map every transparent entry to the first one
+                lookup = np.arange(len(palette), dtype=np.uint8)
+                lookup[transparent] = transparent[0]
+                index_map = lookup[index_map]
+                params["transparency"] = int(transparent[0])
+                # Every frame replaces the previous one instead of being drawn over it
+                params["disposal"] = 2
+            image = Image.fromarray(np.ascontiguousarray(index_map, dtype=np.uint8), mode='P')
+            image.putpalette(palette[:, :3].tobytes())
+            if i == 0:
+                header, _ = GifImagePlugin.getheader(image, info={"loop": loop})
+                f.write(b''.join(header))
+            f.write(b''.join(GifImagePlugin.getdata(image, **params)))
+        f.write(b';')
+
+
+def write_frames(output, frames, num_frames, size=DEFAULT_SIZE, file_format="gif", delay_ms=40, loop=0,
+                 compress_level=6, text=None):
+    """Write (index_map, palette) frames as a GIF, an APNG, a directory of PNG files or a frame ring.
+
+    For "shm" the output is the shared memory name of a new frame ring (see
+    frame_ring.py), and frames are written at the frame rate given by
+    delay_ms, once.
+    """
+    if file_format == "gif":
+        write_gif(output, frames, delay_ms, loop)
+    elif file_format == "apng":
+        write_apng(output, size, (apply_palette(palette, index_map) for index_map, palette in frames), num_frames,
+                   delay_ms, loop, compress_level, text)
+    elif file_format == "frames":
+        os.makedirs(output, exist_ok=True)
+        digits = len(str(max(num_frames - 1, 0)))
+        for i, (index_map, palette) in enumerate(frames):
+            write_png(os.path.join(output, f"frame_{i:0{digits}d}.png"), apply_palette(palette, index_map),
+                      compress_level, text)
+    elif file_format == "shm":
+        from frame_ring import FrameRing, stream
+
+        ring = FrameRing.create(output, size)
+        try:
+            stream(ring, ((apply_palette(palette, index_map), None) for index_map, palette in frames),
+                   1000 / delay_ms)
+        finally:
+            ring.close()
+    else:
+        raise ValueError(f"Unknown animation format: {file_format}")
+
+
+def _format_for(output):
+    """Guess the output format from the output path"""
+    extension = os.path.splitext(output)[1].lower()
+    if extension == ".gif":
+        return "gif"
+    if extension in (".png", ".apng"):
+        return "apng"
+    return "frames"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export an animated Snake Illusion control stimulus")
+    parser.add_argument("project", help="Project JSON file saved from the GUI")
+    parser.add_argument("-o", "--output", default="snake_animation.gif",
+                        help="Output .gif or .png (APNG) file, a directory for numbered frames, "
+                             "or a shared memory name with --format shm")
+    parser.add_argument("--format", choices=FORMATS, help="Output format (default: from the output name)")
+    parser.add_argument("--mode", choices=MODES, default="rotate", help="Kind of motion (default: rotate)")
+    parser.add_argument("--frames", type=int, default=60, help="Number of frames")
+    parser.add_argument("--step", type=float, default=1.0, help="Rotation per frame in degrees (rotate mode)")
+    parser.add_argument("--same-direction", action="store_true",
+                        help="Rotate both discs counterclockwise instead of in opposite directions")
+    parser.add_argument("--fps", type=float, default=25.0, help="Frames per second")
+    parser.add_argument("--loop", type=int, default=0, help="Number of plays, 0 repeats forever")
+    args = parser.parse_args(argv)
+    if args.fps <= 0:
+        parser.error("--fps must be positive")
+
+    file_format = args.format or _format_for(args.output)
+    try:
+        with open(args.project, 'r') as f:
+            params = json.load(f)
+        colors = params_colors(params)
+        background = params_background(params)
+        frames = animation_frames(params["widths"], params["num_patterns"], colors, background,
+                                  params["shift_angle"], params["use_classic_pattern"], args.mode, args.frames,
+                                  args.step, not args.same_direction)
+        text = params_text({
+            "colors": [c.lower() for c in colors],
+            "widths": [round(float(w), 6) for w in params["widths"]],
+            "num_patterns": int(params["num_patterns"]),
+            "shift_angle": round(float(params["shift_angle"]), 6),
+            "background": None if background is None else background.lower(),
+            "use_classic_pattern": bool(params["use_classic_pattern"]),
+            "mode": args.mode,
+            "frames": args.frames,
+            "step": args.step,
+            "counter_rotate": not args.same_direction,
+            "fps": args.fps
+        })
+        write_frames(args.output, frames, args.frames, DEFAULT_SIZE, file_format, 1000 / args.fps, args.loop,
+                     text=text)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{args.frames} frames saved as: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import colorsys
+
+import numpy as np
+
+# Two-digit lowercase hex strings for every channel value
+HEX_BYTES = np.array([f'{i:02x}' for i in range(256)])
+
+# Value of each ASCII hex digit, indexed by character code
+_HEX_DIGIT_VALUES = np.zeros(256, dtype=np.int64)
+for _digit in '0123456789abcdef':
+    _HEX_DIGIT_VALUES[ord(_digit)] = int(_digit, 16)
+    _HEX_DIGIT_VALUES[ord(_digit.upper())] = int(_digit, 16)
+
+
+def get_color_saturation(hex_color):
+    """Get the saturation value of a hex color (0-1)"""
+    hex_color = hex_color.lstrip('#')
+    r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+    h, s, v = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
+    return s
+
+
+def set_color_saturation(hex_color, saturation_percent):
+    """Set the saturation of a hex color to an absolute percentage (0-100%)"""
+    hex_color = hex_color.lstrip('#')
+    r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+    # Check if this is a grayscale color (R=G=B or very close)
+    if abs(r - g) < 5 and abs(g - b) < 5 and abs(r - b) < 5:
+        # For gray colors, just return the original color
+        # Adjusting saturation doesn't make sense for pure grays
+        return f'#{hex_color}'
+
+    h, s, v = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
+    # Convert percentage to 0-1 range for colorsys
+    s = saturation_percent / 100.0
+    r, g, b = colorsys.hsv_to_rgb(h, s, v)
+    return f'#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}'
+
+
+# Array versions of the helpers above. They give exactly the same results as
+# the colorsys-based functions, one array of colors at a time.
+
+def hex_to_rgb_array(hex_colors):
+    """Convert hex colors (with or without '#') to an int array of shape (..., 3)"""
+    stripped = np.char.lstrip(np.asarray(hex_colors, dtype=str), '#')
+    codes = np.char.encode(stripped, 'ascii').astype('S6')
+    characters = np.frombuffer(codes.tobytes(), dtype=np.uint8).reshape(codes.shape + (6,))
+    digits = _HEX_DIGIT_VALUES[characters]
+    return digits[..., 0::2] * 16 + digits[..., 1::2]
+
+
+def rgb_to_hex_array(rgb):
+    """Convert an int array of shape (..., 3) to lowercase '#rrggbb' strings"""
+    rgb = np.asarray(rgb)
+    return np.char.add(np.char.add(np.char.add('#', HEX_BYTES[rgb[..., 0]]), HEX_BYTES[rgb[..., 1]]),
+                       HEX_BYTES[rgb[..., 2]])
+
+
+def rgb_to_hsv_array(rgb):
+    """colorsys.rgb_to_hsv for a float array of shape (..., 3), returning (h, s, v)"""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    v = maxc
+    gray = minc == maxc
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = rangec / maxc
+        rc = (maxc - r) / rangec
+        gc = (maxc - g) / rangec
+        bc = (maxc - b) / rangec
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.mod(h / 6.0, 1.0)
+    return np.where(gray, 0.0, h), np.where(gray, 0.0, s), v
+
+
+def hsv_to_rgb_array(h, s, v):
+    """colorsys.hsv_to_rgb for broadcastable float arrays, returning shape (..., 3)"""
+    h, s, v = np.broadcast_arrays(h, s, v)
+    i = (h * 6.0).astype(np.int64)  # Truncates like int() for h >= 0
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+
+    # Channel order for each sector i = 0..5
+    choices = np.stack([v, q, p, p, t, v,
+                        t, v, v, q, p, p,
+                        p, p, t, v, v, q]).reshape((3, 6) + h.shape)
+    sector = np.broadcast_to(i, (3, 1) + h.shape)
+    rgb = np.take_along_axis(choices, sector, axis=1)[:, 0]
+    rgb = np.where(s == 0.0, v, rgb)
+    return np.moveaxis(rgb, 0, -1)
+
+
+def _is_gray(rgb):
+    """Mask of colors whose channels all differ by less than 5"""
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    return (np.abs(r - g) < 5) & (np.abs(g - b) < 5) & (np.abs(r - b) < 5)
+
+
+def get_color_saturations(hex_colors):
+    """Array version of get_color_saturation"""
+    _, s, _ = rgb_to_hsv_array(hex_to_rgb_array(hex_colors) / 255)
+    return s
+
+
+def set_rgb_saturations(rgb, saturation_percents):
+    """Apply set_color_saturation to an int RGB array of shape (..., 3).
+
+    saturation_percents broadcasts against the colors, so a (colors,) array of
+    colors with a (settings, colors) array of percentages gives every setting
+    at once. Near-gray colors (all channel differences < 5) pass through.
+    """
+    rgb = np.asarray(rgb)
+    h, _, v = rgb_to_hsv_array(rgb / 255)
+    s = np.asarray(saturation_percents) / 100.0
+    saturated = (hsv_to_rgb_array(h, s, v) * 255).astype(np.int64)
+    return np.where(_is_gray(rgb)[..., None], rgb, saturated)
+
+
+def set_color_saturations(hex_colors, saturation_percents):
+    """Array version of set_color_saturation, returning an array of hex strings"""
+    stripped = np.char.lstrip(np.asarray(hex_colors, dtype=str), '#')
+    rgb = hex_to_rgb_array(stripped)
+    saturated = set_rgb_saturations(rgb, saturation_percents)
+    # Grays keep their original spelling, as in set_color_saturation
+    return np.where(_is_gray(rgb), np.char.add('#', stripped), rgb_to_hex_array(saturated))
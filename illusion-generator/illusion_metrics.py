@@ -0,0 +1,259 @@
+"""Luminance-step statistics that predict illusion strength before any participant sees it.
+
+Usage:
+    python illusion_metrics.py rank specs.npy --top 50 -o best.npy
+    python illusion_metrics.py rank sweep.json --top 20
+    python illusion_metrics.py image snake_illusion_p24_....png
+
+The rotating-snake illusion depends on the order of luminance steps around a
+disc: motion is seen from black toward dark gray and from white toward light
+gray, that is from each luminance extreme toward its lower-contrast
+neighbor. For every color of the pattern, in the order the wedges are drawn,
+this module computes
+
+    lightness   CIE L* (0-100) of the saturated color
+    step        L* change to the next color (cyclic)
+    asymmetry   (|step in| - |step out|) / (|step in| + |step out|), positive
+                when the next color is the lower-contrast neighbor
+
+and per pattern
+
+    mean_step, min_step, max_step   absolute L* steps
+    motion_index   mean asymmetry of the extremes (darker or lighter than
+                   both neighbors), -1..1; the sign gives the predicted
+                   direction relative to the color order and extremes that
+                   disagree cancel out
+    score          |motion_index| * mean_step / 100, the ranking heuristic
+
+The right disc repeats the left colors in reversed or classic order, which
+mirrors the sequence, so its statistics are the left disc's with the sign of
+motion_index flipped.
+
+spec_metrics works on whole spec tables (see spec_table.py) at once, and the
+metrics of a table file are cached next to it, so ranking 100k candidates
+takes well under a second after the first run. image_metrics measures the
+same statistics from a rendered stimulus, by sampling the outer ring of the
+left disc.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from illusion_renderer import DISC_OFFSET, INNER_RADII, START_ANGLE, VIEW_EXTENT
+from spec_table import CHUNK_SIZE, MAX_COLORS, load_table, params_records, saturated_rgb
+
+METRICS_DTYPE = np.dtype([
+    ("lightness", np.float64, (MAX_COLORS,)),
+    ("step", np.float64, (MAX_COLORS,)),
+    ("asymmetry", np.float64, (MAX_COLORS,)),
+    ("mean_step", np.float64),
+    ("min_step", np.float64),
+    ("max_step", np.float64),
+    ("motion_index", np.float64),
+    ("score", np.float64)
+])
+CACHE_SUFFIX = ".metrics.npy"
+
+
+def lightness(rgb):
+    """CIE L* (0-100) of an sRGB uint8 array of shape (..., 3)"""
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    y = linear @ np.array([0.2126, 0.7152, 0.0722])
+    f = np.where(y > (6 / 29) ** 3, np.cbrt(y), y / (3 * (6 / 29) ** 2) + 4 / 29)
+    return 116 * f - 16
+
+
+def step_statistics(values, counts):
+    """Cyclic step statistics of rows of values, where row i uses its first counts[i] entries.
+
+    Returns (step, asymmetry, summary) with step and asymmetry shaped like
+    values (NaN past each row's count) and summary a dict of per-row arrays
+    mean_step, min_step, max_step, motion_index and score.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    counts = np.asarray(counts)[:, None]
+    position = np.arange(values.shape[1])
+    valid = position < counts
+    following = np.take_along_axis(values, np.where(position + 1 < counts, position + 1, 0), axis=1)
+    preceding = np.take_along_axis(values, np.where(position > 0, position - 1, counts - 1), axis=1)
+    step_out = following - values
+    step_in = values - preceding
+
+    size_in, size_out = np.abs(step_in), np.abs(step_out)
+    total = size_in + size_out
+    with np.errstate(divide='ignore', invalid='ignore'):
+        asymmetry = np.where(total > 0, (size_in - size_out) / total, 0.0)
+    # Extremes are darker or lighter than both neighbors
+    extreme = valid & (step_in * step_out < 0)
+    num_extremes = extreme.sum(axis=1)
+    motion_index = np.where(extreme, asymmetry, 0.0).sum(axis=1) / np.maximum(num_extremes, 1)
+
+    steps = np.where(valid, size_out, np.nan)
+    mean_step = np.nanmean(steps, axis=1)
+    summary = {
+        "mean_step": mean_step,
+        "min_step": np.nanmin(steps, axis=1),
+        "max_step": np.nanmax(steps, axis=1),
+        "motion_index": motion_index,
+        "score": np.abs(motion_index) * mean_step / 100
+    }
+    return np.where(valid, step_out, np.nan), np.where(valid, asymmetry, np.nan), summary
+
+
+def spec_metrics(table):
+    """METRICS_DTYPE record of every record of a spec table (or a SPEC_DTYPE array)"""
+    metrics = np.zeros(len(table), dtype=METRICS_DTYPE)
+    for start in range(0, len(table), CHUNK_SIZE):
+        chunk = np.asarray(table[start:start + CHUNK_SIZE])
+        colors, _ = saturated_rgb(chunk)
+        counts = chunk["num_colors"].astype(np.int64)
+        values = np.where(np.arange(MAX_COLORS) < counts[:, None], lightness(colors), np.nan)
+        step, asymmetry, summary = step_statistics(values, counts)
+
+        result = metrics[start:start + len(chunk)]
+        result["lightness"] = values
+        result["step"] = step
+        result["asymmetry"] = asymmetry
+        for name, column in summary.items():
+            result[name] = column
+    return metrics
+
+
+def table_metrics(table_path):
+    """spec_metrics of a table file, cached in a .metrics.npy file next to it"""
+    cache_path = table_path + CACHE_SUFFIX
+    table = load_table(table_path)
+    try:
+        if os.stat(cache_path).st_mtime >= os.stat(table_path).st_mtime:
+            metrics = np.load(cache_path)
+            if metrics.dtype == METRICS_DTYPE and len(metrics) == len(table):
+                return metrics
+    except (OSError, ValueError):
+        pass
+    metrics = spec_metrics(table)
+    # Written under a temporary name, like the render cache, so a reader never sees a partial file
+    temp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+    np.save(temp_path, metrics)
+    os.replace(temp_path, cache_path)
+    return metrics
+
+
+def rank(metrics, top=None):
+    """Indices of the records ordered by descending score, ties in table order"""
+    order = np.argsort(-metrics["score"], kind='stable')
+    return order if top is None else order[:top]
+
+
+def _ring_samples(image, samples):
+    """RGBA colors along the middle of the outer ring of the left disc, in wedge order"""
+    height, width = image.shape[:2]
+    left, right, bottom, top = VIEW_EXTENT
+    scale = min(width / (right - left), height / (top - bottom))
+    radius = (INNER_RADII[0] + INNER_RADII[1]) / 2
+    # Wedges run clockwise from the start angle
+    angles = np.radians(START_ANGLE - np.arange(samples) * 360.0 / samples)
+    x = -DISC_OFFSET + radius * np.cos(angles)
+    y = radius * np.sin(angles)
+    cols = np.round((x - (left + right) / 2) * scale + width / 2 - 0.5).astype(np.int64)
+    rows = np.round(height / 2 - 0.5 - (y - (bottom + top) / 2) * scale).astype(np.int64)
+    return image[np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1)]
+
+
+def image_metrics(image, samples=7200, min_run=3):
+    """Step statistics measured from a rendered full illusion (RGBA uint8).
+
+    The outer ring of the left disc is sampled at the given number of angles
+    and split into runs of equal color; runs shorter than min_run samples
+    (anti-aliased edges) are dropped. Returns a dict with the per-run
+    lightness, step and asymmetry lists and the summary statistics.
+    """
+    colors = _ring_samples(np.asarray(image), samples)
+    packed = colors.astype(np.uint32) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.uint32)
+    starts = np.flatnonzero(np.concatenate([[True], packed[1:] != packed[:-1]]))
+    lengths = np.diff(np.concatenate([starts, [samples]]))
+    if len(starts) > 1 and packed[0] == packed[-1]:
+        # The first and last runs are one wedge cut at the start angle
+        lengths[0] += lengths[-1]
+        starts, lengths = starts[:-1], lengths[:-1]
+    keep = lengths >= min_run
+    starts = starts[keep]
+    if len(starts) < 2:
+        raise ValueError("The image has no wedges to measure")
+    # Dropping short runs can leave equal neighbors, which are one wedge
+    run_colors = packed[starts]
+    distinct = np.concatenate([[True], run_colors[1:] != run_colors[:-1]])
+    if len(run_colors) > 1 and run_colors[0] == run_colors[-1]:
+        distinct[0] = False
+    starts = starts[distinct]
+
+    values = lightness(colors[starts, :3])[None, :]
+    step, asymmetry, summary = step_statistics(values, [values.shape[1]])
+    result = {name: float(column[0]) for name, column in summary.items()}
+    result.update(segments=int(values.shape[1]), lightness=values[0].tolist(), step=step[0].tolist(),
+                  asymmetry=asymmetry[0].tolist())
+    return result
+
+
+def _load_candidates(path):
+    """Spec table of a .npy table or a sweep JSON file"""
+    if path.endswith(".npy"):
+        return load_table(path)
+    from illusion_spec import expand_sweep
+
+    with open(path, 'r') as f:
+        return params_records(list(expand_sweep(json.load(f))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predict and rank illusion strength from luminance steps")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rank_parser = commands.add_parser("rank", help="Rank the points of a spec table or sweep")
+    rank_parser.add_argument("candidates", help=".npy spec table or sweep JSON file")
+    rank_parser.add_argument("--top", type=int, default=20, help="Number of candidates to keep")
+    rank_parser.add_argument("-o", "--output", help="Write the top candidates to this .npy spec table")
+    image_parser = commands.add_parser("image", help="Measure rendered full illusions")
+    image_parser.add_argument("images", nargs="+", help="PNG files")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "image":
+            # Pillow is installed with matplotlib; only reading images needs it
+            from PIL import Image
+
+            for file_path in args.images:
+                with Image.open(file_path) as image:
+                    result = image_metrics(np.asarray(image.convert("RGBA")))
+                print(f"{file_path}\tscore {result['score']:.3f}\tmotion {result['motion_index']:+.3f}\t"
+                      f"mean step {result['mean_step']:.1f}\t{result['segments']} wedges")
+            return 0
+
+        if args.candidates.endswith(".npy"):
+            table = load_table(args.candidates)
+            metrics = table_metrics(args.candidates)
+        else:
+            table = _load_candidates(args.candidates)
+            metrics = spec_metrics(table)
+        order = rank(metrics, args.top)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for index in order.tolist():
+        record, metric = table[index], metrics[index]
+        num_colors = int(record["num_colors"])
+        colors = '-'.join(f"{c:06x}" for c in record["colors"][:num_colors].tolist())
+        saturations = '-'.join(f"{s:g}" for s in record["saturations"][:num_colors].tolist())
+        print(f"{index}\tscore {metric['score']:.3f}\tmotion {metric['motion_index']:+.3f}\t"
+              f"mean step {metric['mean_step']:.1f}\tc{colors}\ts{saturations}")
+    if args.output:
+        np.save(args.output, np.asarray(table[order]))
+        print(f"{len(order)} candidates written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+import functools
+import os
+
+import numpy as np
+
+from illusion_colors import hex_to_rgb_array
+
+# Geometry shared with SnakeIllusionApp.generate_full_illusion
+INNER_RADII = np.array(np.linspace(1, 0.03, num=9)) * 2
+DISC_OFFSET = 2
+START_ANGLE = 90
+
+# Visible area of a saved illusion (left, right, bottom, top) in data units.
+# The two discs span x = -4..4 and the tight bounding box keeps the
+# -2.5..2.5 axes height, which gives 739x462 pixels at dpi=100.
+VIEW_EXTENT = (-DISC_OFFSET - INNER_RADII[0], DISC_OFFSET + INNER_RADII[0], -2.5, 2.5)
+DEFAULT_SIZE = (739, 462)
+
+# Pattern strip of SnakeIllusionApp.generate_preview: 4x2 inches at dpi=100,
+# bars from x = 0.1 to 0.9 filling the full height
+STRIP_SIZE = (400, 200)
+STRIP_MARGIN = 0.1
+
+# Optional directory for memory-mapped polar maps, see polar_maps
+POLAR_MAP_DIR = os.environ.get("SNAKE_ILLUSION_POLAR_MAPS")
+
+# Larger or supersampled images are rendered in horizontal tiles of about
+# TILE_SAMPLES samples each, so memory use does not grow with the image size
+MAX_UNTILED_PIXELS = 2 ** 22
+TILE_SAMPLES = 2 ** 20
+
+
+def right_disc_order(num_colors, use_classic_pattern):
+    """Return the color/width permutation used by the right disc"""
+    if use_classic_pattern:
+        # Classic: swap colors and widths [0,1,2,3] -> [0,3,2,1]
+        return [0, 3, 2, 1]
+    # Complete reversal: reverse everything
+    return list(range(num_colors))[::-1]
+
+
+@functools.lru_cache(maxsize=4)
+def pixel_grid(size=DEFAULT_SIZE, extent=VIEW_EXTENT):
+    """Return data coordinates (x, y) of the pixel centers of an image of the given size.
+
+    The extent is fitted into the image with equal aspect and centered, so any
+    pixel size keeps the discs circular. Row 0 is the top of the image. Grids
+    are cached and shared between renders, so they are returned read-only.
+    """
+    x, y = grid_rows(size, extent, 0, size[1])
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
+
+
+def grid_rows(size, extent, start, stop):
+    """Return the rows start..stop of pixel_grid(size, extent), without caching"""
+    width, height = size
+    left, right, bottom, top = extent
+    scale = min(width / (right - left), height / (top - bottom))
+    x_center = (left + right) / 2
+    y_center = (bottom + top) / 2
+    xs = x_center + (np.arange(width) + 0.5 - width / 2) / scale
+    ys = y_center - (np.arange(start, stop) + 0.5 - height / 2) / scale
+    return np.meshgrid(xs, ys)
+
+
+class PolarMaps:
+    """Per-pixel polar coordinates of the two discs at one resolution.
+
+    Only pixels inside a disc are stored, left disc first: pixel holds their
+    flat index in the image, ring the radius ring (0 = outermost, the center
+    circle counts as ring 8), angle the polar angle in degrees about the
+    pixel's own disc center and center marks the center circle. The first
+    left_count entries belong to the left disc.
+    """
+
+    FIELDS = ["pixel", "ring", "angle", "center"]
+
+    def __init__(self, shape, left_count, pixel, ring, angle, center):
+        self.shape = shape
+        self.left_count = left_count
+        self.pixel = pixel
+        self.ring = ring
+        self.angle = angle
+        self.center = center
+
+    @classmethod
+    def compute(cls, size, extent=VIEW_EXTENT):
+        return cls.from_grid(*pixel_grid(size, extent))
+
+    @classmethod
+    def from_grid(cls, x, y, disc_centers=(-DISC_OFFSET, DISC_OFFSET)):
+        """Compute the maps for arbitrary pixel center coordinates of equal shape.
+
+        disc_centers are the x positions of the discs; left_count counts the
+        pixels of the first one.
+        """
+        pixels, rings, angles, centers = [], [], [], []
+        for center_x in disc_centers:
+            dx = x.ravel() - center_x
+            dy = y.ravel()
+            distance = np.hypot(dx, dy)
+
+            # Ring k is the smallest pie whose radius still covers the pixel. The radii
+            # decrease, so counting the radii >= distance is a search in -INNER_RADII.
+            ring = np.searchsorted(-INNER_RADII, -distance, side='right') - 1
+            inside = np.flatnonzero(ring >= 0)
+            pixels.append(inside)
+            rings.append(ring[inside].astype(np.int8))
+            angles.append(np.degrees(np.arctan2(dy[inside], dx[inside])))
+            centers.append(distance[inside] <= INNER_RADII[-1])
+
+        return cls(x.shape, len(pixels[0]), np.concatenate(pixels), np.concatenate(rings),
+                   np.concatenate(angles), np.concatenate(centers))
+
+    def save(self, directory):
+        """Write the maps as .npy files that load() can memory-map"""
+        os.makedirs(directory, exist_ok=True)
+        arrays = [(name, getattr(self, name)) for name in self.FIELDS]
+        # left_count goes last, so its presence means the maps are complete
+        arrays.append(("left_count", np.array(self.left_count)))
+        for name, array in arrays:
+            # Write under a temporary name so concurrent readers never see a partial file
+            temp_path = os.path.join(directory, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(temp_path, array)
+            os.replace(temp_path, os.path.join(directory, f"{name}.npy"))
+
+    @classmethod
+    def load(cls, directory, shape):
+        arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in cls.FIELDS]
+        left_count = int(np.load(os.path.join(directory, "left_count.npy")))
+        return cls(shape, left_count, *arrays)
+
+
+@functools.lru_cache(maxsize=4)
+def polar_maps(size=DEFAULT_SIZE, extent=VIEW_EXTENT):
+    """Return the PolarMaps for an image size, computing them once per process.
+
+    If SNAKE_ILLUSION_POLAR_MAPS names a directory, maps are stored there and
+    memory-mapped, so worker processes share one copy instead of each
+    computing its own.
+    """
+    size = tuple(size)
+    shape = (size[1], size[0])
+    if POLAR_MAP_DIR is None:
+        return PolarMaps.compute(size, extent)
+
+    extent_str = '_'.join(f"{v:g}" for v in extent)
+    directory = os.path.join(POLAR_MAP_DIR, f"polar_{size[0]}x{size[1]}_{extent_str}")
+    if not os.path.exists(os.path.join(directory, "left_count.npy")):
+        PolarMaps.compute(size, extent).save(directory)
+    return PolarMaps.load(directory, shape)
+
+
+def illusion_index_map(width_pattern, pattern_repeats, num_colors, shift_angle, use_classic_pattern=False,
+                       transparent_center=False, size=DEFAULT_SIZE, start_angles=(START_ANGLE, START_ANGLE)):
+    """Compute the palette index of every pixel of the full illusion.
+
+    The result indexes the palette built by illusion_palette, so the same map
+    can be recolored without recomputing any geometry. This reproduces the
+    stack of ax.pie calls: ring k is drawn with startangle 90 + (k + 1) *
+    shift_angle, wedges run clockwise, and smaller rings cover larger ones.
+    start_angles replaces the 90 degrees of the (left, right) disc, which
+    rotates the disc counterclockwise.
+    """
+    return _index_from_maps(polar_maps(tuple(size)), width_pattern, pattern_repeats, num_colors, shift_angle,
+                            use_classic_pattern, transparent_center, start_angles)
+
+
+def wedge_index(ring, angle, widths, pattern_repeats, shift_angle, start_angle=START_ANGLE):
+    """Index into widths of the wedge covering each pixel of a disc.
+
+    ring and angle are the per-pixel ring number and polar angle in degrees,
+    as stored in PolarMaps. Ring k of the stack of ax.pie calls starts at
+    start_angle + (k + 1) * shift_angle and its wedges run clockwise.
+    """
+    # One start angle per ring, gathered for every pixel
+    ring_startangles = start_angle + (np.arange(len(INNER_RADII)) + 1) * shift_angle
+    fraction = np.mod(ring_startangles[ring] - angle, 360.0) / 360.0
+    # One period holds one copy of the pattern
+    period_position = np.mod(fraction * pattern_repeats, 1.0)
+
+    cumulative = np.cumsum(widths, dtype=float)
+    cumulative /= cumulative[-1]
+    disc_index = np.searchsorted(cumulative, period_position, side='right')
+    return np.minimum(disc_index, len(widths) - 1)
+
+
+def _index_from_maps(maps, width_pattern, pattern_repeats, num_colors, shift_angle, use_classic_pattern,
+                     transparent_center, start_angles=(START_ANGLE, START_ANGLE)):
+    """Palette index map of illusion_index_map for the pixels described by maps"""
+    width_pattern = list(width_pattern)[:num_colors]
+    order = right_disc_order(num_colors, use_classic_pattern)
+    right_width_pattern = [width_pattern[i] for i in order]
+
+    index = np.empty(len(maps.pixel), dtype=np.intp)
+    discs = [(slice(0, maps.left_count), width_pattern, 0, start_angles[0]),
+             (slice(maps.left_count, None), right_width_pattern, num_colors, start_angles[1])]
+    for pixels, widths, palette_offset, start_angle in discs:
+        index[pixels] = wedge_index(maps.ring[pixels], maps.angle[pixels], widths, pattern_repeats,
+                                    shift_angle, start_angle) + palette_offset
+
+    if not transparent_center:
+        index[maps.center] = 2 * num_colors
+
+    # Everything outside the discs shows the background
+    lookup = np.full(maps.shape[0] * maps.shape[1], 2 * num_colors + 1, dtype=np.uint8)
+    lookup[maps.pixel] = index
+    return lookup.reshape(maps.shape)
+
+
+def illusion_palette(left_colors, background, use_classic_pattern=False):
+    """Build the RGBA palette indexed by illusion_index_map.
+
+    Layout: left colors, right colors, center circle, outside the discs.
+    """
+    order = right_disc_order(len(left_colors), use_classic_pattern)
+    palette = np.zeros((2 * len(left_colors) + 2, 4), dtype=np.uint8)
+    left_rgb = hex_to_rgb_array(left_colors)
+    palette[:len(left_colors), :3] = left_rgb
+    palette[len(left_colors):-2, :3] = left_rgb[order]
+    palette[:-2, 3] = 255
+    if background is not None:
+        palette[-2:, :3] = hex_to_rgb_array(background)
+        palette[-2:, 3] = 255
+    return palette
+
+
+def apply_palette(palette, index):
+    """Look up an RGBA uint8 palette for every entry of an index map"""
+    # Indexing one uint32 per color is several times faster than indexing rows of 4 bytes
+    colors = np.ascontiguousarray(palette, dtype=np.uint8).view(np.uint32).ravel()
+    return colors[index].view(np.uint8).reshape(index.shape + (4,))
+
+
+def render_full_illusion(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                         use_classic_pattern=False, size=DEFAULT_SIZE, supersample=1):
+    """Rasterize the full two-disc illusion into an RGBA uint8 array of shape (height, width, 4).
+
+    With supersample = N every pixel averages an N x N grid of samples, which
+    anti-aliases the wedge edges.
+    """
+    if supersample > 1:
+        return np.concatenate(list(render_illusion_tiles(width_pattern, pattern_repeats, left_colors, background,
+                                                         shift_angle, use_classic_pattern, size, supersample)))
+    lookup = illusion_index_map(width_pattern, pattern_repeats, len(left_colors), shift_angle,
+                                use_classic_pattern, background is None, size)
+    return apply_palette(illusion_palette(left_colors, background, use_classic_pattern), lookup)
+
+
+def render_spec(spec, size=DEFAULT_SIZE, supersample=1):
+    """Rasterize an IllusionSpec into an RGBA uint8 array.
+
+    The image depends only on the arguments, so the GUI, batch workers and
+    tests all get identical pixels for the same spec.
+    """
+    return render_full_illusion(spec.widths, spec.num_patterns, spec.colors, spec.background, spec.shift_angle,
+                                spec.use_classic_pattern, size, supersample)
+
+
+def render_spec_rows(spec, size=DEFAULT_SIZE, supersample=1):
+    """Yield the image of render_spec as row blocks, see render_illusion_rows"""
+    return render_illusion_rows(spec.widths, spec.num_patterns, spec.colors, spec.background, spec.shift_angle,
+                                spec.use_classic_pattern, size, supersample)
+
+
+def is_tiled(size, supersample=1):
+    """Whether render_illusion_rows renders an image of this size in tiles"""
+    return supersample > 1 or size[0] * size[1] > MAX_UNTILED_PIXELS
+
+
+def render_illusion_tiles(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                          use_classic_pattern=False, size=DEFAULT_SIZE, supersample=1, tile_samples=TILE_SAMPLES):
+    """Yield the full illusion as RGBA uint8 row blocks, top to bottom.
+
+    Each block computes its own geometry for at most about tile_samples
+    samples, so any image size renders in bounded memory. Blocks join to
+    exactly render_full_illusion(..., size, supersample).
+    """
+    width, height = size
+    sample_size = (width * supersample, height * supersample)
+    palette = illusion_palette(left_colors, background, use_classic_pattern)
+    tile_rows = max(1, tile_samples // (sample_size[0] * supersample))
+    for start in range(0, height, tile_rows):
+        stop = min(start + tile_rows, height)
+        maps = PolarMaps.from_grid(*grid_rows(sample_size, VIEW_EXTENT, start * supersample, stop * supersample))
+        samples = apply_palette(palette, _index_from_maps(maps, width_pattern, pattern_repeats, len(left_colors),
+                                                          shift_angle, use_classic_pattern, background is None))
+        yield downsample(samples, supersample) if supersample > 1 else samples
+
+
+def render_illusion_rows(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                         use_classic_pattern=False, size=DEFAULT_SIZE, supersample=1):
+    """Yield the full illusion as row blocks, in one block when it fits without tiling"""
+    if is_tiled(size, supersample):
+        yield from render_illusion_tiles(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                                         use_classic_pattern, size, supersample)
+    else:
+        yield render_full_illusion(width_pattern, pattern_repeats, left_colors, background, shift_angle,
+                                   use_classic_pattern, size)
+
+
+def downsample(samples, factor):
+    """Average factor x factor blocks of an RGBA uint8 image.
+
+    Colors are weighted by alpha, so transparent samples at the disc edges
+    fade the edge out instead of darkening it.
+    """
+    rows, cols = samples.shape[0] // factor, samples.shape[1] // factor
+    blocks = samples.reshape(rows, factor, cols, factor, 4).astype(np.float64)
+    alpha = blocks[..., 3:].sum(axis=(1, 3))
+    color = (blocks[..., :3] * blocks[..., 3:]).sum(axis=(1, 3))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        color = np.where(alpha > 0, color / alpha, 0.0)
+
+    result = np.empty((rows, cols, 4), dtype=np.uint8)
+    result[..., :3] = np.round(color)
+    result[..., 3:] = np.round(alpha / factor ** 2)
+    return result
+
+
+def render_pattern_strip(width_pattern, colors, background=None, size=STRIP_SIZE):
+    """Rasterize the single-pattern bar strip of the preview as an RGBA uint8 array"""
+    width, height = size
+    relative_widths = np.asarray(width_pattern, dtype=float)[:len(colors)]
+    relative_widths = relative_widths / relative_widths.sum() * (1 - 2 * STRIP_MARGIN)
+    edges = STRIP_MARGIN + np.concatenate([[0.0], np.cumsum(relative_widths)])
+
+    palette = np.zeros((len(colors) + 1, 4), dtype=np.uint8)
+    palette[:-1, :3] = hex_to_rgb_array(colors)
+    palette[:-1, 3] = 255
+    if background is not None:
+        palette[-1, :3] = hex_to_rgb_array(background)
+        palette[-1, 3] = 255
+
+    # Bar i covers [edges[i], edges[i + 1]); pixels outside the bars show the background
+    x = (np.arange(width) + 0.5) / width
+    bar = np.searchsorted(edges, x, side='right') - 1
+    bar = np.where((bar >= 0) & (bar < len(colors)), bar, len(colors))
+    return np.broadcast_to(palette[bar], (height, width, 4)).copy()
+
+
+class IllusionRasterizer:
+    """Renders full illusions, reusing the pixel geometry while only the colors change"""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = tuple(size)
+        self.geometry = None
+        self.index = None
+
+    def render(self, width_pattern, pattern_repeats, left_colors, background, shift_angle,
+               use_classic_pattern=False):
+        """Same as render_full_illusion, but recolors the previous index map when possible"""
+        geometry = (tuple(width_pattern), pattern_repeats, len(left_colors), shift_angle,
+                    use_classic_pattern, background is None)
+        if geometry != self.geometry:
+            self.index = illusion_index_map(width_pattern, pattern_repeats, len(left_colors), shift_angle,
+                                            use_classic_pattern, background is None, self.size)
+            self.geometry = geometry
+        return apply_palette(illusion_palette(left_colors, background, use_classic_pattern), self.index)
+
+    def render_spec(self, spec):
+        """Same as render_spec at this rasterizer's size"""
+        return self.render(spec.widths, spec.num_patterns, spec.colors, spec.background, spec.shift_angle,
+                           spec.use_classic_pattern)
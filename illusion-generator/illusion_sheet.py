@@ -0,0 +1,204 @@
+"""Full-screen sheets of rotating-snake discs, like assets/kitaoka_original.gif.
+
+Usage:
+    python illusion_sheet.py project.json --rows 15 --cols 20 -o sheet.png
+
+The project file is a project saved from the GUI (or a dict yielded by
+illusion_spec.expand_sweep). Discs are laid out on a grid with a fixed gap
+between them. Each disc uses either the original color order of the left
+disc or the reversed order of the right disc, and its own shift angle.
+
+Every distinct (orientation, shift angle) disc is rasterized once and then
+stamped into a shared palette-index canvas, so a sheet of hundreds of discs
+costs little more than one disc plus the final palette lookup.
+
+Per-disc settings can be given with --layout, a JSON file such as:
+
+    {
+      "orientation": [["original", "reversed"], ["reversed", "original"]],
+      "shift_angle": [[-12.5, -12.5], [12.5, 12.5]]
+    }
+
+with one row per sheet row and one entry per disc.
+"""
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from illusion_colors import hex_to_rgb_array
+from illusion_renderer import INNER_RADII, PolarMaps, apply_palette, grid_rows, right_disc_order, wedge_index
+from illusion_spec import params_background, params_colors
+from png_export import params_text, write_png
+
+DISC_SIZE = 200  # Disc diameter in pixels
+SPACING = 20  # Gap between discs and around the sheet in pixels
+ORIENTATIONS = {"original": False, "reversed": True}
+
+
+def disc_polar_maps(disc_size):
+    """PolarMaps of one disc centered in a disc_size x disc_size square"""
+    radius = INNER_RADII[0]
+    x, y = grid_rows((disc_size, disc_size), (-radius, radius, -radius, radius), 0, disc_size)
+    return PolarMaps.from_grid(x, y, disc_centers=(0,))
+
+
+def disc_index_map(maps, width_pattern, pattern_repeats, num_colors, shift_angle, reversed_order=False,
+                   use_classic_pattern=False, transparent_center=False):
+    """Palette index map of one disc, see sheet_palette for the palette layout"""
+    width_pattern = list(width_pattern)[:num_colors]
+    order = np.arange(num_colors)
+    if reversed_order:
+        order = np.array(right_disc_order(num_colors, use_classic_pattern))
+
+    # Wedge k of a reversed disc has color order[k] of the original colors
+    index = order[wedge_index(maps.ring, maps.angle, [width_pattern[i] for i in order], pattern_repeats,
+                              shift_angle)]
+    if not transparent_center:
+        index[maps.center] = num_colors
+
+    lookup = np.full(maps.shape[0] * maps.shape[1], num_colors + 1, dtype=np.uint8)
+    lookup[maps.pixel] = index
+    return lookup.reshape(maps.shape)
+
+
+def sheet_palette(colors, background):
+    """RGBA palette of a sheet: the colors, the center circle, then the background"""
+    palette = np.zeros((len(colors) + 2, 4), dtype=np.uint8)
+    palette[:-2, :3] = hex_to_rgb_array(colors)
+    palette[:-2, 3] = 255
+    if background is not None:
+        palette[-2:, :3] = hex_to_rgb_array(background)
+        palette[-2:, 3] = 255
+    return palette
+
+
+def sheet_size(rows, cols, disc_size=DISC_SIZE, spacing=SPACING):
+    """Pixel size (width, height) of a sheet"""
+    return (cols * disc_size + (cols + 1) * spacing, rows * disc_size + (rows + 1) * spacing)
+
+
+def _per_disc(value, rows, cols, name):
+    """Broadcast a scalar or a rows x cols nested list to a (rows, cols) array"""
+    array = np.asarray(value)
+    if array.ndim not in (0, 2) or (array.ndim == 2 and array.shape != (rows, cols)):
+        raise ValueError(f"{name} must be a single value or {rows} rows of {cols} values")
+    return np.broadcast_to(array, (rows, cols))
+
+
+def disc_orientations(orientation, rows, cols):
+    """Return a (rows, cols) bool array, True where a disc uses the reversed order.
+
+    orientation is "original", "reversed", "alternate" (a checkerboard
+    starting with an original disc, so neighbors turn in opposite
+    directions) or a rows x cols nested list of "original"/"reversed".
+    """
+    if isinstance(orientation, str) and orientation == "alternate":
+        return (np.add.outer(np.arange(rows), np.arange(cols)) % 2).astype(bool)
+    names = _per_disc(orientation, rows, cols, "orientation")
+    unknown = set(names.ravel().tolist()) - set(ORIENTATIONS)
+    if unknown:
+        raise ValueError(f"Unknown orientation: {', '.join(sorted(unknown))}")
+    return np.vectorize(ORIENTATIONS.get, otypes=[bool])(names)
+
+
+def render_sheet(width_pattern, pattern_repeats, colors, background, rows, cols, shift_angle=-12.5,
+                 orientation="alternate", use_classic_pattern=False, disc_size=DISC_SIZE, spacing=SPACING):
+    """Rasterize a rows x cols sheet of discs into an RGBA uint8 array.
+
+    shift_angle is one angle for every disc or a rows x cols nested list,
+    orientation is as in disc_orientations. colors are the saturated colors
+    of the original order and background is None for transparent.
+    """
+    num_colors = len(colors)
+    if use_classic_pattern and num_colors != 4:
+        raise ValueError("Classic patterns need exactly 4 colors")
+    if spacing < 0 or disc_size < 1:
+        raise ValueError("Disc size must be positive and spacing must not be negative")
+    reversed_discs = disc_orientations(orientation, rows, cols)
+    shift_angles = _per_disc(shift_angle, rows, cols, "shift_angle").astype(float)
+    transparent_center = background is None
+
+    maps = disc_polar_maps(disc_size)
+    inside = np.zeros(maps.shape[0] * maps.shape[1], dtype=bool)
+    inside[maps.pixel] = True
+    inside = inside.reshape(maps.shape)
+
+    width, height = sheet_size(rows, cols, disc_size, spacing)
+    canvas = np.full((height, width), num_colors + 1, dtype=np.uint8)
+    stamps = {}
+    pitch = disc_size + spacing
+    for row in range(rows):
+        for col in range(cols):
+            key = (bool(reversed_discs[row, col]), float(shift_angles[row, col]))
+            if key not in stamps:
+                stamps[key] = disc_index_map(maps, width_pattern, pattern_repeats, num_colors, key[1], key[0],
+                                             use_classic_pattern, transparent_center)
+            top = spacing + row * pitch
+            left = spacing + col * pitch
+            np.copyto(canvas[top:top + disc_size, left:left + disc_size], stamps[key], where=inside)
+
+    return apply_palette(sheet_palette(colors, background), canvas)
+
+
+def render_project_sheet(params, rows, cols, orientation="alternate", shift_angle=None, disc_size=DISC_SIZE,
+                         spacing=SPACING):
+    """Render a sheet for a project dict, using its shift angle unless one is given"""
+    if shift_angle is None:
+        shift_angle = params["shift_angle"]
+    return render_sheet(params["widths"], params["num_patterns"], params_colors(params), params_background(params),
+                        rows, cols, shift_angle, orientation, params["use_classic_pattern"], disc_size, spacing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a sheet of rotating-snake discs")
+    parser.add_argument("project", help="Project JSON file saved from the GUI")
+    parser.add_argument("-o", "--output", default="snake_sheet.png", help="Output PNG file")
+    parser.add_argument("--rows", type=int, default=3, help="Number of disc rows")
+    parser.add_argument("--cols", type=int, default=4, help="Number of disc columns")
+    parser.add_argument("--disc-size", type=int, default=DISC_SIZE, help="Disc diameter in pixels")
+    parser.add_argument("--spacing", type=int, default=SPACING, help="Gap between discs in pixels")
+    parser.add_argument("--orientation", default="alternate", choices=["alternate"] + list(ORIENTATIONS),
+                        help="Color order of every disc (default: alternate in a checkerboard)")
+    parser.add_argument("--layout", help="JSON file with per-disc orientation and/or shift_angle lists")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.project, 'r') as f:
+            params = json.load(f)
+        orientation = args.orientation
+        shift_angle = None
+        if args.layout:
+            with open(args.layout, 'r') as f:
+                layout = json.load(f)
+            orientation = layout.get("orientation", orientation)
+            shift_angle = layout.get("shift_angle")
+
+        image = render_project_sheet(params, args.rows, args.cols, orientation, shift_angle, args.disc_size,
+                                     args.spacing)
+        write_png(args.output, image, text=params_text({
+            "colors": [c.lower() for c in params_colors(params)],
+            "widths": [round(float(w), 6) for w in params["widths"]],
+            "num_patterns": int(params["num_patterns"]),
+            "background": params_background(params),
+            "use_classic_pattern": bool(params["use_classic_pattern"]),
+            "rows": args.rows,
+            "cols": args.cols,
+            "disc_size": args.disc_size,
+            "spacing": args.spacing,
+            "orientation": np.where(disc_orientations(orientation, args.rows, args.cols),
+                                    "reversed", "original").tolist(),
+            "shift_angle": _per_disc(params["shift_angle"] if shift_angle is None else shift_angle,
+                                     args.rows, args.cols, "shift_angle").astype(float).tolist()
+        }))
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Sheet of {args.rows}x{args.cols} discs saved as: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
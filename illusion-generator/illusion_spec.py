@@ -0,0 +1,238 @@
+import itertools
+
+from illusion_colors import get_color_saturation, set_color_saturation, set_color_saturations
+
+# Keys accepted in a sweep spec
+SWEEP_KEYS = ["colors", "saturations", "widths", "num_patterns", "shift_angle",
+              "background", "background_saturation", "pattern_type"]
+PATTERN_TYPES = {"reversed": False, "classic": True}
+
+
+def pattern_strings(colors, saturations, widths):
+    """Format the color, saturation and width parts of an exported filename"""
+    num_colors = len(colors)
+    colors_str = '-'.join([colors[i].replace('#', '') for i in range(num_colors)])
+    saturations_str = '-'.join([f"{int(saturations[i])}" for i in range(num_colors)])
+    widths_str = '-'.join([f"{widths[i]:.1f}" for i in range(num_colors)])
+
+    if num_colors == 3:
+        colors_str += "-X"
+        saturations_str += "-X"
+        widths_str += "-X"
+    return colors_str, saturations_str, widths_str
+
+
+def illusion_filename(colors, saturations, widths, num_patterns, shift_angle, background,
+                      use_classic_pattern, extension="png"):
+    """Build the parameter-embedded illusion filename.
+
+    colors are the saturated hex colors, saturations are percentages and
+    background is the saturated hex color or None for transparent.
+    """
+    colors_str, saturations_str, widths_str = pattern_strings(colors, saturations, widths)
+
+    # Add background specification - either transparent or hex code
+    if background is None:
+        bg_str = "bg-transparent"
+    else:
+        bg_str = f"bg-{background.replace('#', '')}"
+
+    # Add pattern type to filename
+    pattern_type_str = "classic" if use_classic_pattern else "reversed"
+
+    return (f"snake_illusion_p{num_patterns}_c{colors_str}_"
+            f"s{saturations_str}_w{widths_str}_a{shift_angle:.1f}_{bg_str}_{pattern_type_str}.{extension}")
+
+
+def preview_filename(colors, saturations, widths):
+    """Build the filename of a single pattern strip"""
+    colors_str, saturations_str, widths_str = pattern_strings(colors, saturations, widths)
+    return f"single_pattern_c{colors_str}_s{saturations_str}_w{widths_str}.png"
+
+
+def params_colors(params):
+    """Return the colors of a project dict with their saturation applied"""
+    saturations = [int(saturation) for saturation in params["saturations"]]
+    return set_color_saturations(params["colors"], saturations).tolist()
+
+
+def saturation_percent(saturation):
+    """Whole percentage of a 0-1 saturation, so that e.g. 0.29 gives 29 and not int(28.999...)"""
+    return int(round(saturation * 100, 6))
+
+
+def params_background(params):
+    """Return the saturated background color of a project dict, or None if transparent"""
+    background = params["background"]
+    if background["transparent"]:
+        return None
+    return set_color_saturation(background["color"], saturation_percent(background["saturation"]))
+
+
+def params_filename(params, extension="png"):
+    """Build the illusion filename for a project dict"""
+    return illusion_filename(params_colors(params), params["saturations"], params["widths"],
+                             params["num_patterns"], params["shift_angle"], params_background(params),
+                             params["use_classic_pattern"], extension)
+
+
+class IllusionSpec:
+    """Everything that determines a rendered illusion, independent of the GUI.
+
+    colors are the saturated hex colors of the left disc (3 or 4), widths the
+    relative width of each color, background the saturated hex color or None
+    for transparent. Specs are normalized on creation, so equal settings give
+    equal (and equally hashed) specs and render to identical images.
+    """
+    # No per-instance __dict__, so millions of specs stay small (see spec_table.py for bulk storage)
+    __slots__ = ("colors", "widths", "num_patterns", "shift_angle", "background", "use_classic_pattern")
+
+    def __init__(self, colors, widths, num_patterns=24, shift_angle=-12.5, background="#808080",
+                 use_classic_pattern=False):
+        num_colors = len(colors)
+        if num_colors not in (3, 4):
+            raise ValueError(f"Expected 3 or 4 colors, got {num_colors}")
+        if len(widths) < num_colors:
+            raise ValueError(f"Expected {num_colors} widths, got {len(widths)}")
+        if use_classic_pattern and num_colors != 4:
+            raise ValueError("Classic patterns need exactly 4 colors")
+        self.colors = tuple(c.lower() for c in colors)
+        self.widths = tuple(float(w) for w in widths[:num_colors])
+        if min(self.widths) <= 0:
+            raise ValueError("Widths must be positive")
+        self.num_patterns = int(num_patterns)
+        if self.num_patterns < 1:
+            raise ValueError("The number of patterns must be positive")
+        self.shift_angle = float(shift_angle)
+        self.background = None if background is None else background.lower()
+        self.use_classic_pattern = bool(use_classic_pattern)
+
+    @classmethod
+    def from_params(cls, params):
+        """Spec of a project dict, with the saturations applied to its colors"""
+        return cls(params_colors(params), params["widths"], params["num_patterns"], params["shift_angle"],
+                   params_background(params), params["use_classic_pattern"])
+
+    @property
+    def num_colors(self):
+        return len(self.colors)
+
+    def _fields(self):
+        return (self.colors, self.widths, self.num_patterns, self.shift_angle, self.background,
+                self.use_classic_pattern)
+
+    def canonical_args(self, size, dpi=100, supersample=1):
+        """Arguments of render_cache.canonical_params and cache_key for this spec"""
+        return self._fields() + (size, dpi, supersample)
+
+    def __eq__(self, other):
+        if not isinstance(other, IllusionSpec):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return (f"IllusionSpec(colors={list(self.colors)}, widths={list(self.widths)}, "
+                f"num_patterns={self.num_patterns}, shift_angle={self.shift_angle}, "
+                f"background={self.background!r}, use_classic_pattern={self.use_classic_pattern})")
+
+
+def _options(sweep, key, default, nested=False):
+    """Return the list of values a sweep gives for one key"""
+    value = sweep.get(key, default)
+    if not isinstance(value, list):
+        return [value]
+    if nested and not any(isinstance(option, list) for option in value):
+        # A single color/width list rather than a list of options
+        return [value]
+    return value
+
+
+def _sweep_options(sweep):
+    """Return the option lists of a sweep, in SWEEP_KEYS order"""
+    return [_options(sweep, "colors", [["#000000", "#B0B0B0", "#FFFFFF", "#707070"]], nested=True),
+            _options(sweep, "saturations", None, nested=True),
+            _options(sweep, "widths", [[1.0, 1.0, 1.0, 1.0]], nested=True),
+            _options(sweep, "num_patterns", [24]),
+            _options(sweep, "shift_angle", [-12.5]),
+            _options(sweep, "background", ["#808080"]),
+            _options(sweep, "background_saturation", [None]),
+            _options(sweep, "pattern_type", ["reversed"])]
+
+
+def sweep_size(sweep):
+    """Number of project dicts expand_sweep yields for a sweep"""
+    options = _sweep_options(sweep)
+    size = 1
+    for option in options:
+        size *= len(option)
+    # Classic patterns are skipped for 3-color combinations
+    color_options, pattern_type_options = options[0], options[-1]
+    skipped_colors = sum(1 for colors in color_options if len(colors) != 4)
+    skipped_patterns = sum(1 for pattern_type in pattern_type_options if PATTERN_TYPES.get(pattern_type))
+    if skipped_colors and skipped_patterns:
+        size = size // (len(color_options) * len(pattern_type_options)) * (
+            len(color_options) * len(pattern_type_options) - skipped_colors * skipped_patterns)
+    return size
+
+
+def expand_sweep(sweep):
+    """Lazily yield one project dict per combination of a sweep spec.
+
+    A sweep maps each key of SWEEP_KEYS to a list of options (a single value is
+    also accepted). Colors, saturations and widths options are lists with one
+    entry per color; a null saturation keeps the color's own saturation, a
+    "transparent" background disables the background and a null background
+    saturation keeps the background color's own saturation. Classic patterns
+    are skipped for 3-color combinations, as in the GUI.
+    """
+    unknown = set(sweep) - set(SWEEP_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown sweep keys: {', '.join(sorted(unknown))}")
+
+    options = _sweep_options(sweep)
+    color_options, saturation_options, width_options = options[:3]
+    pattern_type_options = options[-1]
+
+    for colors in color_options:
+        if len(colors) not in (3, 4):
+            raise ValueError(f"Expected 3 or 4 colors, got {len(colors)}")
+    for option in saturation_options + width_options:
+        if option is not None and len(option) < max(len(c) for c in color_options):
+            raise ValueError(f"Saturation/width option {option} has fewer entries than colors")
+    for pattern_type in pattern_type_options:
+        if pattern_type not in PATTERN_TYPES:
+            raise ValueError(f"Unknown pattern type: {pattern_type}")
+
+    combinations = itertools.product(*options)
+
+    for colors, saturations, widths, num_patterns, shift_angle, background, bg_saturation, pattern_type in combinations:
+        num_colors = len(colors)
+        use_classic_pattern = PATTERN_TYPES[pattern_type]
+        if use_classic_pattern and num_colors != 4:
+            continue
+
+        if saturations is None:
+            saturations = [get_color_saturation(c) * 100 for c in colors]
+        transparent = background == "transparent"
+        if transparent:
+            background = "#808080"
+        if bg_saturation is None:
+            bg_saturation = get_color_saturation(background) * 100
+
+        yield {
+            "background": {
+                "color": background,
+                "saturation": bg_saturation / 100.0,
+                "transparent": transparent
+            },
+            "colors": list(colors),
+            "saturations": list(saturations[:num_colors]),
+            "widths": [float(w) for w in widths[:num_colors]],
+            "num_patterns": num_patterns,
+            "shift_angle": float(shift_angle),
+            "num_colors": num_colors,
+            "use_classic_pattern": use_classic_pattern
+        }
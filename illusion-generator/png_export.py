@@ -0,0 +1,150 @@
+"""Direct PNG encoding of rendered RGBA images.
+
+Writes the image buffer as-is with zlib, so saving skips matplotlib's
+savefig and its extra tight-bounding-box draw. write_png_rows streams
+images that are rendered in tiles and write_apng streams animation frames. Parameters can be stored as
+PNG text chunks next to the pixels, and read back with read_png_text.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+SOFTWARE = "Snake Illusion Generator"
+
+
+def _chunk(chunk_type, data):
+    """Encode one PNG chunk: length, type, data and CRC"""
+    return (struct.pack('>I', len(data)) + chunk_type + data +
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def _header(width, height, channels, text, dpi):
+    """Signature and the chunks that precede the image data"""
+    color_type = {3: 2, 4: 6}[channels]
+    chunks = [_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))]
+    if dpi:
+        pixels_per_meter = int(round(dpi / 0.0254))
+        chunks.append(_chunk(b'pHYs', struct.pack('>IIB', pixels_per_meter, pixels_per_meter, 1)))
+    for keyword, value in (text or {}).items():
+        chunks.append(_chunk(b'tEXt', keyword.encode('latin-1') + b'\x00' + str(value).encode('latin-1')))
+    return PNG_SIGNATURE + b''.join(chunks)
+
+
+def _scanlines(image):
+    """Raw image data of a block of rows, every scanline starting with filter type 0 (None)"""
+    height, width, channels = image.shape
+    scanlines = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    scanlines[:, 1:] = image.reshape(height, width * channels)
+    return scanlines.tobytes()
+
+
+def encode_png(image, compress_level=6, text=None, dpi=100):
+    """Encode an RGBA or RGB uint8 array of shape (height, width, channels) as PNG bytes.
+
+    text is an optional dict of keyword -> value stored in tEXt chunks, and
+    dpi is recorded in a pHYs chunk like matplotlib does.
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width, channels = image.shape
+    return (_header(width, height, channels, text, dpi) +
+            _chunk(b'IDAT', zlib.compress(_scanlines(image), compress_level)) + _chunk(b'IEND', b''))
+
+
+def write_png(file_path, image, compress_level=6, text=None, dpi=100):
+    """Write an RGBA or RGB uint8 array to a PNG file, see encode_png"""
+    with open(file_path, 'wb') as f:
+        f.write(encode_png(image, compress_level, text, dpi))
+
+
+def write_png_rows(file_path, size, row_blocks, compress_level=6, text=None, dpi=100, channels=4):
+    """Write a PNG of size (width, height) from an iterable of uint8 row blocks, top to bottom.
+
+    Blocks are compressed as they arrive, so only one block is in memory at a time.
+    """
+    width, height = size
+    compressor = zlib.compressobj(compress_level)
+    rows = 0
+    with open(file_path, 'wb') as f:
+        f.write(_header(width, height, channels, text, dpi))
+        for block in row_blocks:
+            block = np.ascontiguousarray(block, dtype=np.uint8)
+            if block.shape[1:] != (width, channels):
+                raise ValueError(f"Row block of shape {block.shape} does not fit a {width}x{height} image")
+            rows += len(block)
+            data = compressor.compress(_scanlines(block))
+            if data:
+                f.write(_chunk(b'IDAT', data))
+        f.write(_chunk(b'IDAT', compressor.flush()))
+        f.write(_chunk(b'IEND', b''))
+    if rows != height:
+        raise ValueError(f"Got {rows} rows for an image of height {height}")
+
+
+def write_apng(file_path, size, frames, num_frames, delay_ms=40, loop=0, compress_level=6, text=None, dpi=100,
+               channels=4):
+    """Write an animated PNG from an iterable of num_frames uint8 images of size (width, height).
+
+    Frames are compressed and written as they arrive, so only one frame is
+    in memory at a time. Each frame is shown for delay_ms milliseconds and
+    loop is the number of plays (0 repeats forever). Viewers without APNG
+    support show the first frame.
+    """
+    width, height = size
+    sequence = 0
+    count = 0
+    with open(file_path, 'wb') as f:
+        f.write(_header(width, height, channels, text, dpi))
+        f.write(_chunk(b'acTL', struct.pack('>II', num_frames, loop)))
+        for frame in frames:
+            frame = np.ascontiguousarray(frame, dtype=np.uint8)
+            if frame.shape != (height, width, channels) or count >= num_frames:
+                raise ValueError(f"Frame {count} of shape {frame.shape} does not fit a {num_frames}-frame "
+                                 f"{width}x{height} animation")
+            # Replace the whole canvas with each frame (dispose none, blend source)
+            f.write(_chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence, width, height, 0, 0,
+                                                int(round(delay_ms)), 1000, 0, 0)))
+            sequence += 1
+            data = zlib.compress(_scanlines(frame), compress_level)
+            if count == 0:
+                f.write(_chunk(b'IDAT', data))
+            else:
+                f.write(_chunk(b'fdAT', struct.pack('>I', sequence) + data))
+                sequence += 1
+            count += 1
+        f.write(_chunk(b'IEND', b''))
+    if count != num_frames:
+        raise ValueError(f"Got {count} frames for a {num_frames}-frame animation")
+
+
+def read_png_text(file_path):
+    """Return the tEXt chunks of a PNG file as a dict"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f"{file_path} is not a PNG file")
+
+    text = {}
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+        if chunk_type == b'tEXt':
+            keyword, _, value = data[offset + 8:offset + 8 + length].partition(b'\x00')
+            text[keyword.decode('latin-1')] = value.decode('latin-1')
+        elif chunk_type == b'IEND':
+            break
+        offset += 12 + length
+    return text
+
+
+def params_text(params):
+    """Text chunks recording the render parameters of an image as JSON"""
+    return {"Software": SOFTWARE, "Parameters": json.dumps(params, sort_keys=True)}
+
+
+def read_png_params(file_path):
+    """Return the render parameters stored by params_text, or None if the file has none"""
+    parameters = read_png_text(file_path).get("Parameters")
+    return None if parameters is None else json.loads(parameters)
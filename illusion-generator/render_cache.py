@@ -0,0 +1,186 @@
+"""On-disk cache of rendered illusion PNGs.
+
+Entries are keyed by a hash of the canonical render parameters, so the same
+illusion is only rendered once across GUI sessions and sweep reruns. Each
+entry records the zlib level its PNG was written with, and a lookup at
+another level is a miss, so the new file replaces it. The cache is capped in
+size and evicts the least recently used files first.
+
+Usage:
+    python render_cache.py stats [--cache-dir DIR]
+    python render_cache.py clear [--cache-dir DIR]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+DEFAULT_CACHE_DIR = os.environ.get("SNAKE_ILLUSION_CACHE",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "snake-illusion"))
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GB
+
+
+def canonical_params(colors, widths, num_patterns, shift_angle, background, use_classic_pattern, size, dpi,
+                     supersample=1):
+    """Normalize the parameters that fully determine a rendered illusion.
+
+    colors are the colors after set_color_saturation and background is the
+    saturated background color, or None for transparent.
+    """
+    params = {
+        "colors": [c.lower() for c in colors],
+        "widths": [round(float(w), 6) for w in widths],
+        "num_patterns": int(num_patterns),
+        "shift_angle": round(float(shift_angle), 6),
+        "background": None if background is None else background.lower(),
+        "use_classic_pattern": bool(use_classic_pattern),
+        "size": [int(v) for v in size],
+        "dpi": int(dpi)
+    }
+    # Only recorded when used, so keys of plain renders stay the same
+    if supersample > 1:
+        params["supersample"] = int(supersample)
+    return params
+
+
+def cache_key(colors, widths, num_patterns, shift_angle, background, use_classic_pattern, size, dpi,
+              supersample=1):
+    """Hash the canonical parameters of a rendered illusion"""
+    canonical = canonical_params(colors, widths, num_patterns, shift_angle, background, use_classic_pattern,
+                                 size, dpi, supersample)
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Size-capped LRU cache of PNG files, indexed in a small SQLite database"""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # Several worker processes may share the cache, so wait for locks instead of failing
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), timeout=30)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries "
+                            "(key TEXT PRIMARY KEY, size INTEGER, last_used REAL, compress_level INTEGER)")
+            # Caches created before the compress level was recorded; their entries never match a level
+            if "compress_level" not in [row[1] for row in self.db.execute("PRAGMA table_info(entries)")]:
+                self.db.execute("ALTER TABLE entries ADD COLUMN compress_level INTEGER")
+            self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def _count(self, name):
+        self.db.execute("INSERT INTO counters VALUES (?, 1) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key, file_path, compress_level=6):
+        """Copy the cached file for key, written at compress_level, to file_path. Returns False on a miss."""
+        path = self.entry_path(key)
+        row = self.db.execute("SELECT compress_level FROM entries WHERE key = ?", (key,)).fetchone()
+        copied = False
+        if row is not None and row[0] == compress_level:
+            try:
+                shutil.copyfile(path, file_path)
+                copied = True
+            except OSError:
+                # Evicted by another process since the lookup, or removed behind our back
+                pass
+        with self.db:
+            if not copied:
+                if row is not None and not os.path.exists(path):
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count("misses")
+                return False
+            self.db.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._count("hits")
+        return True
+
+    def put(self, key, file_path, compress_level=6):
+        """Store a copy of a rendered file written at compress_level under key, evicting old entries if needed"""
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy under a temporary name so readers never see a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries (key, size, last_used, compress_level) "
+                            "VALUES (?, ?, ?, ?)", (key, os.path.getsize(path), time.time(), compress_level))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        with self.db:
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.remove(self.entry_path(key))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        """Return entry count, total size and hit/miss counters"""
+        entries, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        counters = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self.db:
+            for (key,) in self.db.execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self.entry_path(key))
+                except FileNotFoundError:
+                    pass
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("DELETE FROM counters")
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or clear the illusion render cache")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Cache directory")
+    args = parser.parse_args(argv)
+
+    cache = RenderCache(args.cache_dir)
+    if args.command == "clear":
+        cache.clear()
+        print(f"Cleared {args.cache_dir}")
+    else:
+        stats = cache.stats()
+        print(f"Cache directory: {args.cache_dir}")
+        print(f"Entries: {stats['entries']} ({stats['bytes'] / 1024 ** 2:.1f} MB "
+              f"of {stats['max_bytes'] / 1024 ** 2:.0f} MB)")
+        print(f"Hits: {stats['hits']}  Misses: {stats['misses']}  Hit rate: {stats['hit_rate']:.1%}")
+    cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
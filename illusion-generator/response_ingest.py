@@ -0,0 +1,254 @@
+"""Bulk loading of participant result CSVs from the psychophysical experiment.
+
+Usage:
+    python response_ingest.py results/ -o merged.csv --workers 0
+    python response_ingest.py p001.csv p002.csv --npy merged.npy
+
+Every CSV exported by the experiment (jsPsych, after enrichData()) holds one
+row per trial. This applies the same cleaning as analysis_tool_program.m,
+for all files at once instead of one row at a time:
+
+    - trials without a saturation_pattern or color_scheme are dropped
+    - a trial without a response takes the response of the next row of its
+      file, which is the "You did not respond in time" correction trial
+      (missed_correction)
+    - patterns and colors are stripped of surrounding whitespace, and only
+      the first trial of each pattern/color pair is kept per file
+
+Files are parsed in parallel and joined into one columnar table, a NumPy
+structured array with the fields file, saturation_pattern, color_scheme,
+stimulus (actual_filename, empty when the column is missing), response (NaN
+when still missing) and corrected (True where the response came from the
+next row). merged.csv has the columns of the analysis tool's *_all_fix.csv.
+
+Files of the achromatic control (--achromatic) have no pattern or color
+columns. As in the analysis tool, their trials are matched to patterns by
+the image name in actual_filename (ACHROMATIC_STIMULI), one row per matching
+pattern with the color scheme "achromatic", and only trials without any
+response are left out; the correction trial of a missed response shows the
+same image, so it counts instead.
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+
+import numpy as np
+
+REQUIRED_COLUMNS = ["saturation_pattern", "color_scheme", "response"]
+ACHROMATIC_COLUMNS = ["actual_filename", "response"]
+EXPECTED_TRIALS = 12  # Pattern/color pairs per participant in the current experiment
+
+ACHROMATIC = "achromatic"
+# Gray stimulus shown for each saturation pattern in the achromatic control, as in the analysis tool
+ACHROMATIC_STIMULI = {
+    "10-40-40-100": "snake_illusion_p35_c707070-ffffff-ffffff-000000_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png",
+    "10-70-70-100": "snake_illusion_p35_c707070-ffffff-ffffff-000000_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png",
+    "100-40-40-10": "snake_illusion_p35_c000000-ffffff-ffffff-707070_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png",
+    "100-70-70-10": "snake_illusion_p35_c000000-ffffff-ffffff-707070_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png",
+    "100-70-40-10": "snake_illusion_p35_c000000-B0B0B0-FFFFFF-707070_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png",
+    "10-40-70-100": "snake_illusion_p35_c707070-ffffff-b0b0b0-000000_s0-0-0-0_w1.0-1.0-1.0-1.0_a-15.5_bg-808080.png"
+}
+
+
+def _response_value(value):
+    """Numeric response of a CSV cell, NaN when missing ("", "null", ...)"""
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def read_responses(file_path, required=REQUIRED_COLUMNS):
+    """Read the raw trial columns of one result CSV.
+
+    Returns a dict with the saturation_pattern, color_scheme and stimulus
+    lists and the response array, one entry per row. Columns other than the
+    required ones may be missing and read as empty strings.
+    """
+    # jsPsych quotes the HTML stimulus cells, which may hold commas and newlines
+    with open(file_path, 'r', newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = set(required) - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"{file_path} has no {', '.join(sorted(missing))} column")
+        rows = [(row.get("saturation_pattern") or "", row.get("color_scheme") or "",
+                 row.get("actual_filename") or "", row["response"] or "") for row in reader]
+
+    patterns, colors, stimuli, responses = zip(*rows) if rows else ((), (), (), ())
+    return {
+        "saturation_pattern": [p.strip() for p in patterns],
+        "color_scheme": [c.strip() for c in colors],
+        "stimulus": [s.strip() for s in stimuli],
+        "response": np.array([_response_value(r) for r in responses], dtype=np.float64)
+    }
+
+
+def _read_achromatic(file_path):
+    return read_responses(file_path, ACHROMATIC_COLUMNS)
+
+
+def fix_missed_responses(response, file_index, keep):
+    """Fill missing responses of kept rows from the next row of the same file.
+
+    response is the float column of all rows (NaN when missing), file_index
+    the file of each row and keep the rows that are trials. Returns the fixed
+    responses and a mask of the rows that were fixed.
+    """
+    following = np.append(response[1:], np.nan)
+    same_file = np.append(file_index[1:] == file_index[:-1], False)
+    corrected = keep & np.isnan(response) & same_file
+    return np.where(corrected, following, response), corrected
+
+
+def _first_per_file(file_index, patterns, colors):
+    """Indices of the first row of every (file, pattern, color) in row order"""
+    _, pattern_codes = np.unique(patterns, return_inverse=True)
+    _, color_codes = np.unique(colors, return_inverse=True)
+    key = (file_index.astype(np.int64) * (pattern_codes.max(initial=0) + 1) + pattern_codes.reshape(-1)) * \
+        (color_codes.max(initial=0) + 1) + color_codes.reshape(-1)
+    _, first = np.unique(key, return_index=True)
+    return np.sort(first)
+
+
+def _joined(columns, field):
+    """One column of every file joined into a str array"""
+    return np.array([value for c in columns for value in c[field]], dtype=str)
+
+
+def _table(names, patterns, colors, stimuli, response, corrected):
+    """Structured array of the cleaned trial columns"""
+    fields = [("file", names), ("saturation_pattern", patterns), ("color_scheme", colors), ("stimulus", stimuli)]
+    table = np.zeros(len(response), dtype=[(name, column.dtype if len(column) else "U1")
+                                           for name, column in fields] +
+                     [("response", np.float64), ("corrected", np.bool_)])
+    for name, column in fields:
+        table[name] = column
+    table["response"] = response
+    table["corrected"] = corrected
+    return table
+
+
+def response_table(files, columns):
+    """Join the read_responses columns of files into one cleaned structured array"""
+    lengths = [len(c["response"]) for c in columns]
+    file_index = np.repeat(np.arange(len(files)), lengths)
+    patterns = _joined(columns, "saturation_pattern")
+    colors = _joined(columns, "color_scheme")
+    response = np.concatenate([c["response"] for c in columns]) if columns else np.zeros(0)
+
+    keep = (np.char.str_len(patterns) > 0) & (np.char.str_len(colors) > 0)
+    response, corrected = fix_missed_responses(response, file_index, keep)
+
+    rows = np.flatnonzero(keep)
+    rows = rows[_first_per_file(file_index[rows], patterns[rows], colors[rows])]
+    names = np.array([os.path.basename(f) for f in files], dtype=str)
+    return _table(names[file_index[rows]], patterns[rows], colors[rows],
+                  _joined(columns, "stimulus")[rows], response[rows], np.asarray(corrected[rows]))
+
+
+def achromatic_table(files, columns):
+    """Join the read_responses columns of achromatic control files into a structured array.
+
+    Every trial showing the gray stimulus of a pattern becomes a row of that
+    pattern, so a stimulus shared by two patterns counts for both.
+    """
+    lengths = [len(c["response"]) for c in columns]
+    file_index = np.repeat(np.arange(len(files)), lengths)
+    stimuli = _joined(columns, "stimulus")
+    response = np.concatenate([c["response"] for c in columns]) if columns else np.zeros(0)
+
+    rows, patterns = [], []
+    for pattern, image_name in ACHROMATIC_STIMULI.items():
+        # The analysis tool matches the image name anywhere in actual_filename
+        matches = np.flatnonzero(np.char.find(stimuli, image_name) >= 0)
+        rows.append(matches)
+        patterns.extend([pattern] * len(matches))
+    rows = np.concatenate(rows)
+    order = np.argsort(rows, kind='stable')
+    rows = rows[order]
+    names = np.array([os.path.basename(f) for f in files], dtype=str)
+    return _table(names[file_index[rows]], np.array(patterns, dtype=str)[order],
+                  np.full(len(rows), ACHROMATIC), stimuli[rows], response[rows], np.zeros(len(rows), bool))
+
+
+def load_responses(files, workers=1, achromatic=False):
+    """Read and clean many result CSVs, on a process pool when workers > 1.
+
+    achromatic=True reads files of the achromatic control, see achromatic_table.
+    """
+    read = _read_achromatic if achromatic else read_responses
+    if workers > 1 and len(files) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(workers) as executor:
+            columns = list(executor.map(read, files, chunksize=max(1, len(files) // (workers * 8))))
+    else:
+        columns = [read(f) for f in files]
+    return (achromatic_table if achromatic else response_table)(files, columns)
+
+
+def trial_counts(table):
+    """Number of cleaned trials of every file, as a dict"""
+    names, counts = np.unique(table["file"], return_counts=True)
+    return dict(zip(names.tolist(), counts.tolist()))
+
+
+def write_csv(table, file_path):
+    """Write a response table with the columns of the analysis tool's merged CSV"""
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["file_name", "saturation_pattern", "color_scheme", "response"])
+        for name, pattern, color, _, response, _ in table.tolist():
+            writer.writerow([name, pattern, color, "" if np.isnan(response) else f"{response:g}"])
+
+
+def csv_files(paths):
+    """Expand directories into the CSV files they contain, in name order"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.csv"))))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge and clean participant result CSVs")
+    parser.add_argument("inputs", nargs="+", help="Result CSV files or folders of them")
+    parser.add_argument("-o", "--output", help="Merged CSV file, like the analysis tool's *_all_fix.csv")
+    parser.add_argument("--npy", help="Also save the table as a NumPy .npy file")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of worker processes (0 uses every CPU core)")
+    parser.add_argument("--achromatic", action="store_true",
+                        help="The files are from the achromatic control, matched by actual_filename")
+    parser.add_argument("--expected", type=int, default=EXPECTED_TRIALS,
+                        help=f"Warn about files without this many trials (default: {EXPECTED_TRIALS})")
+    args = parser.parse_args(argv)
+
+    files = csv_files(args.inputs)
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    try:
+        table = load_responses(files, workers, args.achromatic)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    counts = trial_counts(table)
+    for name in (os.path.basename(f) for f in files):
+        if not args.achromatic and counts.get(name, 0) != args.expected:
+            print(f"Warning: {name} has {counts.get(name, 0)} rows after filtering, expected {args.expected}",
+                  file=sys.stderr)
+    if args.output:
+        write_csv(table, args.output)
+    if args.npy:
+        np.save(args.npy, table)
+    print(f"{len(table)} trials from {len(files)} files, {int(table['corrected'].sum())} missed responses "
+          f"taken from the correction trial, {int(np.isnan(table['response']).sum())} still missing")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
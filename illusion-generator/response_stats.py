@@ -0,0 +1,261 @@
+"""Bootstrap intervals and permutation tests for the accuracy of every cell.
+
+Usage:
+    python response_stats.py results/ --achromatic achromat/ --resamples 100000 --seed 1
+    python response_stats.py results/ --workers 0 -o stats.csv
+
+The analysis tool reports the accuracy of every pattern x color cell and
+of the achromatic control. This adds, for all cells at once:
+
+    cells       accuracy, a percentile bootstrap interval over participants,
+                and a sign-flip test against chance (50% correct)
+    contrasts   chromatic minus achromatic accuracy of the same pattern, a
+                bootstrap interval of the difference, and a permutation test
+                that shuffles participants between the two groups
+
+Trials are read and scored as in accuracy_ledger.py, and every statistic
+resamples participants (result files), not trials. Resamples are drawn in
+chunks as matrices of participant weights, labels or signs, so each chunk is
+a few matrix products over the participants x cells count matrices. Every
+chunk has its own random stream spawned from the seed, so results depend
+only on the seed and the chunk size, not on the number of workers.
+"""
+import argparse
+import csv
+import os
+import sys
+import warnings
+
+import numpy as np
+
+from accuracy_ledger import PATTERN_ORDER, trial_outcomes
+from response_ingest import ACHROMATIC, csv_files, load_responses
+
+CHUNK_ELEMENTS = 1 << 22  # Resamples x participants per chunk, about 32 MB of float64 weights
+CHANCE = 0.5
+
+
+def count_matrices(table, cells):
+    """Correct and answered trials of every participant in every cell.
+
+    cells is a list of (saturation_pattern, color_scheme) pairs. Returns
+    (participants, correct, total) with the file names and two float arrays
+    of shape (participants, cells).
+    """
+    trials, correct, answered = trial_outcomes(table)
+    participants, participant_index = np.unique(trials["file"], return_inverse=True)
+    cell_index = {cell: index for index, cell in enumerate(cells)}
+    trial_cells = np.array([cell_index.get(cell, -1) for cell in
+                            zip(trials["saturation_pattern"].tolist(), trials["color_scheme"].tolist())],
+                           dtype=np.int64)
+    known = trial_cells >= 0
+    flat = participant_index.reshape(-1)[known] * len(cells) + trial_cells[known]
+    shape = (len(participants), len(cells))
+    correct_counts = np.bincount(flat, correct[known], shape[0] * shape[1]).reshape(shape)
+    total_counts = np.bincount(flat, answered[known], shape[0] * shape[1]).reshape(shape)
+    return participants, correct_counts, total_counts
+
+
+def table_cells(table):
+    """(saturation_pattern, color_scheme) pairs of a response table with a known answer, in figure order"""
+    trials, _, _ = trial_outcomes(table)
+    cells = set(zip(trials["saturation_pattern"].tolist(), trials["color_scheme"].tolist()))
+    return sorted(cells, key=lambda cell: (PATTERN_ORDER.index(cell[0]), cell[1]))
+
+
+def _ratio(correct, total):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, correct / total, np.nan)
+
+
+def _bootstrap_chunk(correct, total, rng, count):
+    """Accuracy of count participant resamples, shape (count, cells)"""
+    participants = len(correct)
+    # Resampling with replacement is a weight per participant: how often it was drawn
+    draws = rng.integers(0, participants, (count, participants), dtype=np.int32)
+    draws += (np.arange(count, dtype=np.int32) * participants)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=count * participants).reshape(count, participants)
+    weights = weights.astype(np.float64)
+    return _ratio(weights @ correct, weights @ total)
+
+
+def _sign_flip_chunk(excess, rng, count):
+    """Sum of the per-participant correct-minus-chance counts under count random sign flips"""
+    participants = len(excess)
+    bits = rng.integers(0, 256, (count, (participants + 7) // 8), dtype=np.uint8)
+    signs = np.unpackbits(bits, axis=1, count=participants).astype(np.float64) * 2 - 1
+    return signs @ excess
+
+
+def _permutation_chunk(correct, total, size, rng, count):
+    """Accuracy difference of the first size participants vs the rest under count shuffles"""
+    # The size participants with the smallest random keys form the first group
+    keys = rng.random((count, len(correct)), dtype=np.float32)
+    first = np.zeros(keys.shape)
+    np.put_along_axis(first, np.argpartition(keys, size - 1, axis=1)[:, :size], 1.0, axis=1)
+    first_correct, first_total = first @ correct, first @ total
+    rest_correct, rest_total = correct.sum(axis=0) - first_correct, total.sum(axis=0) - first_total
+    return _ratio(first_correct, first_total) - _ratio(rest_correct, rest_total)
+
+
+def _run_chunk(job):
+    function, arguments, seed, count = job
+    return function(*arguments, np.random.default_rng(seed), count)
+
+
+def resample(function, arguments, resamples, seed=None, workers=1, participants=1):
+    """Stack function(*arguments, rng, count) over chunks of resamples, on a process pool when workers > 1.
+
+    seed is an int, None or a numpy SeedSequence; every chunk gets a stream spawned from it.
+    """
+    chunk_size = max(1, CHUNK_ELEMENTS // max(participants, 1))
+    counts = [min(chunk_size, resamples - start) for start in range(0, resamples, chunk_size)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(counts))
+    jobs = [(function, arguments, chunk_seed, count) for chunk_seed, count in zip(seeds, counts)]
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(workers, len(jobs))) as executor:
+            return np.concatenate(list(executor.map(_run_chunk, jobs)))
+    return np.concatenate([_run_chunk(job) for job in jobs])
+
+
+def bootstrap(correct, total, resamples=10000, seed=None, workers=1):
+    """Bootstrap accuracies of every cell, shape (resamples, cells)"""
+    return resample(_bootstrap_chunk, (correct, total), resamples, seed, workers, len(correct))
+
+
+def interval(samples, confidence=0.95):
+    """Percentile interval of bootstrap samples per column, as (low, high) arrays"""
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # Cells without answered trials have no interval
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+    return low, high
+
+
+def _p_value(null, observed):
+    """Two-sided p-value of observed against null samples per column, (1 + extreme) / (1 + resamples)"""
+    extreme = (np.abs(null) >= np.abs(observed) - 1e-12).sum(axis=0)
+    return np.where(np.isnan(observed), np.nan, (1 + extreme) / (1 + len(null)))
+
+
+def sign_flip_test(correct, total, resamples=10000, seed=None, workers=1, chance=CHANCE):
+    """p-value of every cell's accuracy against chance.
+
+    Under the null hypothesis a participant is as likely to be right as
+    wrong, so the sign of each participant's correct-minus-chance count is
+    random.
+    """
+    excess = correct - chance * total
+    null = resample(_sign_flip_chunk, (excess,), resamples, seed, workers, len(correct))
+    observed = np.where(total.sum(axis=0) > 0, excess.sum(axis=0), np.nan)
+    return _p_value(null, observed)
+
+
+def permutation_test(correct_a, total_a, correct_b, total_b, resamples=10000, seed=None, workers=1):
+    """p-value of the accuracy difference between two groups of participants, per column.
+
+    Column k of group a is compared with column k of group b, shuffling the
+    participants of both groups between them.
+    """
+    correct = np.concatenate([correct_a, correct_b])
+    total = np.concatenate([total_a, total_b])
+    null = resample(_permutation_chunk, (correct, total, len(correct_a)), resamples, seed, workers, len(correct))
+    observed = _ratio(correct_a.sum(axis=0), total_a.sum(axis=0)) - _ratio(correct_b.sum(axis=0),
+                                                                            total_b.sum(axis=0))
+    return _p_value(null, observed)
+
+
+def analyze(table, achromatic_table=None, resamples=10000, seed=None, workers=1, confidence=0.95):
+    """Cell and contrast statistics of response tables (see response_ingest.py).
+
+    Returns (cells, contrasts), lists of dicts ready for printing or
+    csv.DictWriter. Contrasts need the achromatic control table.
+    """
+    # Independent streams for every statistic, all derived from the one seed
+    seeds = np.random.SeedSequence(seed).spawn(5)
+    cells = table_cells(table)
+    _, correct, total = count_matrices(table, cells)
+    accuracy = _ratio(correct.sum(axis=0), total.sum(axis=0))
+    samples = bootstrap(correct, total, resamples, seeds[0], workers)
+    low, high = interval(samples, confidence)
+    p_chance = sign_flip_test(correct, total, resamples, seeds[1], workers)
+    cell_rows = [{"saturation_pattern": pattern, "color_scheme": color, "correct": int(c), "total": int(t),
+                  "accuracy": a, "ci_low": lo, "ci_high": hi, "p_chance": p}
+                 for (pattern, color), c, t, a, lo, hi, p in zip(cells, correct.sum(axis=0), total.sum(axis=0),
+                                                                 accuracy, low, high, p_chance)]
+    if achromatic_table is None or not len(achromatic_table):
+        return cell_rows, []
+
+    # Every chromatic cell is compared with the achromatic cell of its pattern
+    baseline = sorted({(pattern, ACHROMATIC) for pattern, _ in cells})
+    _, correct_b, total_b = count_matrices(achromatic_table, baseline)
+    columns = [baseline.index((pattern, ACHROMATIC)) for pattern, _ in cells]
+    correct_a, total_a, correct_b, total_b = correct, total, correct_b[:, columns], total_b[:, columns]
+
+    difference = _ratio(correct_a.sum(axis=0), total_a.sum(axis=0)) - _ratio(correct_b.sum(axis=0),
+                                                                              total_b.sum(axis=0))
+    # The groups are different participants, so they are resampled independently
+    samples_a = bootstrap(correct_a, total_a, resamples, seeds[2], workers)
+    samples_b = bootstrap(correct_b, total_b, resamples, seeds[3], workers)
+    low, high = interval(samples_a - samples_b, confidence)
+    p_values = permutation_test(correct_a, total_a, correct_b, total_b, resamples, seeds[4], workers)
+    contrast_rows = [{"saturation_pattern": pattern, "color_scheme": color, "difference": d, "ci_low": lo,
+                      "ci_high": hi, "p_permutation": p}
+                     for (pattern, color), d, lo, hi, p in zip(cells, difference, low, high, p_values)]
+    return cell_rows, contrast_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bootstrap intervals and permutation tests of response accuracy")
+    parser.add_argument("inputs", nargs="+", help="Result CSV files or folders of them")
+    parser.add_argument("--achromatic", nargs="+", default=[],
+                        help="Result CSV files or folders of the achromatic control")
+    parser.add_argument("--resamples", type=int, default=10000, help="Bootstrap and permutation resamples")
+    parser.add_argument("--seed", type=int, help="Random seed, for reproducible results")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of worker processes (0 uses every CPU core)")
+    parser.add_argument("-o", "--output", help="Also write the statistics to this CSV file")
+    args = parser.parse_args(argv)
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    try:
+        table = load_responses(csv_files(args.inputs), workers)
+        achromatic = load_responses(csv_files(args.achromatic), workers, True) if args.achromatic else None
+        cells, contrasts = analyze(table, achromatic, args.resamples, args.seed, workers, args.confidence)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    level = f"{args.confidence:.0%}"
+    print(f"pattern\tcolor\taccuracy\t{level} CI\tp vs chance")
+    for row in cells:
+        print(f"{row['saturation_pattern']}\t{row['color_scheme']}\t{row['accuracy']:.3f}\t"
+              f"[{row['ci_low']:.3f}, {row['ci_high']:.3f}]\t{row['p_chance']:.4g}")
+    if contrasts:
+        print(f"\npattern\tcolor - achromatic\tdifference\t{level} CI\tp permutation")
+        for row in contrasts:
+            print(f"{row['saturation_pattern']}\t{row['color_scheme']}\t{row['difference']:+.3f}\t"
+                  f"[{row['ci_low']:+.3f}, {row['ci_high']:+.3f}]\t{row['p_permutation']:.4g}")
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "saturation_pattern", "color_scheme", "estimate", "ci_low", "ci_high",
+                             "p_value", "correct", "total"])
+            for row in cells:
+                writer.writerow(["cell", row["saturation_pattern"], row["color_scheme"], row["accuracy"],
+                                 row["ci_low"], row["ci_high"], row["p_chance"], row["correct"], row["total"]])
+            for row in contrasts:
+                writer.writerow(["contrast", row["saturation_pattern"], row["color_scheme"], row["difference"],
+                                 row["ci_low"], row["ci_high"], row["p_permutation"], "", ""])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,4 @@
 import sys
-import numpy as np
-import colorsys
 import matplotlib
 
 matplotlib.use('Qt5Agg')
@@ -10,11 +8,18 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QLabel, QPushButton, QSlider, QRadioButton, QComboBox,
                              QFrame, QCheckBox, QFileDialog, QMessageBox, QSpinBox,
                              QColorDialog, QDoubleSpinBox)
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, QThread, QMutex, QMutexLocker, QWaitCondition, pyqtSignal
 from PyQt5.QtGui import QColor
 import json
 from datetime import datetime
 
+from illusion_colors import get_color_saturation, set_color_saturation, set_color_saturations
+from illusion_renderer import DEFAULT_SIZE, STRIP_SIZE, VIEW_EXTENT, IllusionRasterizer, render_pattern_strip, \
+    render_spec
+from illusion_spec import IllusionSpec, illusion_filename, preview_filename, saturation_percent
+from png_export import params_text, write_png
+from render_cache import RenderCache, canonical_params, cache_key
+
 
 class ColorButton(QPushButton):
     def __init__(self, color="#000000", parent=None):
@@ -28,6 +33,60 @@ class ColorButton(QPushButton):
         self.setStyleSheet(f"background-color: {color}; border: 1px solid black;")
 
 
+class IllusionRenderThread(QThread):
+    """Renders the full illusion in the background, always working on the newest request.
+
+    Requests that arrive while a render is running replace each other, so only
+    the latest one is rendered next, and results that were superseded while
+    rendering are dropped instead of being shown.
+    """
+    rendered = pyqtSignal(int, object, object)  # request id, RGBA image, spec
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.mutex = QMutex()
+        self.condition = QWaitCondition()
+        self.rasterizer = IllusionRasterizer()
+        self.pending = None
+        self.latest_id = 0
+        self.stopping = False
+
+    def request(self, spec):
+        """Queue a render of an IllusionSpec and return its id"""
+        with QMutexLocker(self.mutex):
+            self.latest_id += 1
+            self.pending = (self.latest_id, spec)
+            self.condition.wakeOne()
+            return self.latest_id
+
+    def stop(self):
+        with QMutexLocker(self.mutex):
+            self.stopping = True
+            self.condition.wakeOne()
+        self.wait()
+
+    def run(self):
+        while True:
+            with QMutexLocker(self.mutex):
+                while self.pending is None and not self.stopping:
+                    self.condition.wait(self.mutex)
+                if self.stopping:
+                    return
+                request_id, spec = self.pending
+                self.pending = None
+
+            try:
+                image = self.rasterizer.render_spec(spec)
+            except Exception as e:
+                self.failed.emit(str(e))
+                continue
+
+            # Drop the result if a newer request came in while rendering
+            if request_id == self.latest_id:
+                self.rendered.emit(request_id, image, spec)
+
+
 class SnakeIllusionApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -65,6 +124,15 @@ class SnakeIllusionApp(QMainWindow):
         self.preview_figure = None
         self.current_figure = None
 
+        # Saved illusions are reused from the on-disk render cache
+        self.render_cache = RenderCache()
+
+        # Background renderer for the live full illusion
+        self.render_thread = IllusionRenderThread(self)
+        self.render_thread.rendered.connect(self.show_rendered_illusion)
+        self.render_thread.failed.connect(lambda message: print(f"Illusion render error: {message}"))
+        self.last_illusion_spec = None
+
         # UI components
         self.color_frames = []
         self.color_buttons = []
@@ -91,45 +159,44 @@ class SnakeIllusionApp(QMainWindow):
         self.radio_classic_pattern = None
         self.radio_reversed_pattern = None
 
-        # Set up UI
-        self.setup_ui()
-
-        # Start preview timer
+        # Preview timer: restarted by every change so rapid slider drags render once
         self.update_timer = QTimer()
+        self.update_timer.setSingleShot(True)
+        self.update_timer.setInterval(50)
         self.update_timer.timeout.connect(self.update_preview)
-        self.update_timer.start(500)
+        self.last_preview_params = None
+
+        # Set up UI
+        self.setup_ui()
 
         # Initial preview
+        self.render_thread.start()
         self.update_preview()
 
     def get_color_saturation(self, hex_color):
         """Get the saturation value of a hex color (0-1)"""
-        hex_color = hex_color.lstrip('#')
-        r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
-        h, s, v = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
-        return s
+        return get_color_saturation(hex_color)
 
     def set_color_saturation(self, hex_color, saturation_percent):
         """Set the saturation of a hex color to an absolute percentage (0-100%)"""
-        hex_color = hex_color.lstrip('#')
-        r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
-
-        # Check if this is a grayscale color (R=G=B or very close)
-        if abs(r - g) < 5 and abs(g - b) < 5 and abs(r - b) < 5:
-            # For gray colors, just return the original color
-            # Adjusting saturation doesn't make sense for pure grays
-            return f'#{hex_color}'
-
-        h, s, v = colorsys.rgb_to_hsv(r / 255, g / 255, b / 255)
-        # Convert percentage to 0-1 range for colorsys
-        s = saturation_percent / 100.0
-        r, g, b = colorsys.hsv_to_rgb(h, s, v)
-        return f'#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}'
+        return set_color_saturation(hex_color, saturation_percent)
 
     def get_current_saturated_colors(self):
         """Return all colors with proper saturation applied"""
-        return [self.set_color_saturation(self.original_colors[i],
-                                          int(self.color_saturation[i] * 100)) for i in range(len(self.colors))]
+        saturations = [int(self.color_saturation[i] * 100) for i in range(len(self.colors))]
+        return set_color_saturations(self.original_colors[:len(self.colors)], saturations).tolist()
+
+    def current_background(self):
+        """Return the background color with saturation applied, or None if transparent"""
+        if self.transparent_bg:
+            return None
+        return self.set_color_saturation(self.background_color, saturation_percent(self.background_saturation))
+
+    def current_spec(self):
+        """Return the IllusionSpec of the current settings"""
+        return IllusionSpec(self.get_current_saturated_colors()[:self.num_colors], self.widths[:self.num_colors],
+                            self.num_patterns, self.shift_angle, self.current_background(),
+                            self.use_classic_pattern)
 
     def setup_ui(self):
         # Main layout
@@ -251,14 +318,14 @@ class SnakeIllusionApp(QMainWindow):
 
         self.bg_sat_slider = QSlider(Qt.Horizontal)
         self.bg_sat_slider.setRange(0, 100)
-        self.bg_sat_slider.setValue(int(self.background_saturation * 100))
+        self.bg_sat_slider.setValue(saturation_percent(self.background_saturation))
         self.bg_sat_slider.valueChanged.connect(self.update_bg_saturation)
         bg_sat_layout.addWidget(self.bg_sat_slider)
 
         # Add spin box for background saturation
         self.bg_sat_spin = QSpinBox()
         self.bg_sat_spin.setRange(0, 100)
-        self.bg_sat_spin.setValue(int(self.background_saturation * 100))
+        self.bg_sat_spin.setValue(saturation_percent(self.background_saturation))
         self.bg_sat_spin.setSuffix("%")
         self.bg_sat_slider.valueChanged.connect(self.bg_sat_spin.setValue)
         self.bg_sat_spin.valueChanged.connect(self.bg_sat_slider.setValue)
@@ -480,10 +547,10 @@ class SnakeIllusionApp(QMainWindow):
             self.background_color = color.name()
             self.bg_color_btn.set_color(self.background_color)
             self.background_saturation = self.get_color_saturation(self.background_color)
-            self.bg_sat_slider.setValue(int(self.background_saturation * 100))
-            self.bg_sat_spin.setValue(int(self.background_saturation * 100))
+            self.bg_sat_slider.setValue(saturation_percent(self.background_saturation))
+            self.bg_sat_spin.setValue(saturation_percent(self.background_saturation))
             self.bg_hex_value.setText(f"Hex: {self.background_color}")
-            self.update_preview()
+            self.request_preview()
 
     def choose_color(self, idx):
         color = QColorDialog.getColor(QColor(self.colors[idx]), self, f"Choose Color {idx + 1}")
@@ -495,14 +562,14 @@ class SnakeIllusionApp(QMainWindow):
             self.sat_sliders[idx].setValue(int(self.color_saturation[idx] * 100))
             self.sat_spins[idx].setValue(int(self.color_saturation[idx] * 100))
             self.hex_values[idx].setText(f"Hex: {color.name()}")
-            self.update_preview()
+            self.request_preview()
 
     def toggle_transparent_bg(self, checked):
         self.transparent_bg = checked
         self.bg_color_btn.setEnabled(not checked)
         self.bg_sat_slider.setEnabled(not checked)
         self.bg_sat_spin.setEnabled(not checked)
-        self.update_preview()
+        self.request_preview()
 
     def update_bg_saturation(self, value):
         # Value is now 0-100
@@ -510,7 +577,7 @@ class SnakeIllusionApp(QMainWindow):
         adjusted_color = self.set_color_saturation(self.background_color, value)
         self.bg_color_btn.set_color(adjusted_color)
         self.bg_hex_value.setText(f"Hex: {adjusted_color}")
-        self.update_preview()
+        self.request_preview()
 
     def update_color_saturation(self, idx, value):
         # Value is now 0-100
@@ -519,7 +586,7 @@ class SnakeIllusionApp(QMainWindow):
         self.colors[idx] = adjusted_color
         self.color_buttons[idx].set_color(adjusted_color)
         self.hex_values[idx].setText(f"Hex: {adjusted_color}")
-        self.update_preview()
+        self.request_preview()
 
     def update_width_from_slider(self, idx, value):
         """Update width from slider (scaled by 10)"""
@@ -530,7 +597,7 @@ class SnakeIllusionApp(QMainWindow):
         self.width_spins[idx].setValue(self.widths[idx])
         self.width_spins[idx].blockSignals(False)
 
-        self.update_preview()
+        self.request_preview()
 
     def update_width_from_spinbox(self, idx, value):
         """Update width from spinbox"""
@@ -541,16 +608,16 @@ class SnakeIllusionApp(QMainWindow):
         self.width_sliders[idx].setValue(int(self.widths[idx] * 10))
         self.width_sliders[idx].blockSignals(False)
 
-        self.update_preview()
+        self.request_preview()
 
     def update_width(self, idx, value):
         """Legacy method for compatibility"""
         self.widths[idx] = float(value)
-        self.update_preview()
+        self.request_preview()
 
     def update_patterns(self, value):
         self.num_patterns = value
-        self.update_preview()
+        self.request_preview()
 
     def update_shift_angle(self, value):
         """Update shift angle from slider (scaled by 10)"""
@@ -561,7 +628,7 @@ class SnakeIllusionApp(QMainWindow):
         self.shift_spin.setValue(self.shift_angle)
         self.shift_spin.blockSignals(False)
 
-        self.update_preview()
+        self.request_preview()
 
     def update_shift_angle_from_spinbox(self, value):
         """Update shift angle from spinbox"""
@@ -572,7 +639,7 @@ class SnakeIllusionApp(QMainWindow):
         self.shift_slider.setValue(int(self.shift_angle * 10))
         self.shift_slider.blockSignals(False)
 
-        self.update_preview()
+        self.request_preview()
 
     def set_num_colors(self, count):
         self.num_colors = count
@@ -589,11 +656,11 @@ class SnakeIllusionApp(QMainWindow):
         else:
             self.radio_classic_pattern.setVisible(True)
 
-        self.update_preview()
+        self.request_preview()
 
     def set_pattern_type(self, is_classic):
         self.use_classic_pattern = is_classic
-        self.update_preview()
+        self.request_preview()
 
     def apply_palette(self):
         palette_name = self.palette_combo.currentText()
@@ -627,11 +694,21 @@ class SnakeIllusionApp(QMainWindow):
         self.background_color = background_color
         self.bg_color_btn.set_color(background_color)
         self.background_saturation = self.get_color_saturation(background_color)
-        self.bg_sat_slider.setValue(int(self.background_saturation * 100))
-        self.bg_sat_spin.setValue(int(self.background_saturation * 100))
+        self.bg_sat_slider.setValue(saturation_percent(self.background_saturation))
+        self.bg_sat_spin.setValue(saturation_percent(self.background_saturation))
         self.bg_hex_value.setText(f"Hex: {background_color}")
 
-        self.update_preview()
+        self.request_preview()
+
+    def request_preview(self):
+        """Schedule a preview update, coalescing changes that arrive within the timer interval"""
+        self.update_timer.start()
+        # The full illusion renders off the GUI thread, where newer requests replace older ones
+        try:
+            self.generate_illusion()
+        except ValueError as e:
+            # An exception escaping a Qt slot aborts the application
+            print(f"Illusion error: {e}")
 
     def update_preview(self):
         try:
@@ -640,103 +717,75 @@ class SnakeIllusionApp(QMainWindow):
             colors = self.get_current_saturated_colors()[:self.num_colors]
 
             # Determine background color
-            if self.transparent_bg:
-                bg_color = None
-            else:
-                # Use the properly saturated background color
-                bg_color = self.set_color_saturation(self.background_color,
-                                                     int(self.background_saturation * 100))
+            bg_color = self.current_background()
+            if bg_color is not None:
                 self.bg_display_color = bg_color  # Store for consistency
 
-            # Generate preview
-            fig = self.generate_preview(pattern, self.num_patterns, colors, bg_color, self.shift_angle)
-
-            # Close previous figure if it exists
-            if self.preview_figure is not None:
-                plt.close(self.preview_figure)
-
-            self.preview_figure = fig
-
-            # Clear previous canvas
-            for i in reversed(range(self.preview_frame.layout().count())):
-                widget = self.preview_frame.layout().itemAt(i).widget()
-                if widget:
-                    widget.deleteLater()
+            # Skip the redraw if nothing visible has changed
+            preview_params = (tuple(pattern), tuple(colors), bg_color)
+            if preview_params == self.last_preview_params:
+                return
 
-            # Create new canvas
-            canvas = FigureCanvas(fig)
-            self.preview_frame.layout().addWidget(canvas)
+            if self.preview_figure is None:
+                # First preview: create the figure and its canvas once
+                self.preview_figure = self.generate_preview(pattern, self.num_patterns, colors, bg_color,
+                                                            self.shift_angle)
+                self.preview_frame.layout().addWidget(FigureCanvas(self.preview_figure))
+            else:
+                # Later previews update the existing bars in place
+                self.update_preview_figure(self.preview_figure, pattern, colors, bg_color)
+                self.preview_figure.canvas.draw_idle()
+            self.last_preview_params = preview_params
 
         except Exception as e:
             print(f"Preview error: {e}")
 
     def generate_illusion(self):
+        """Request a background render of the full illusion with the current settings"""
         try:
-            # Get current values with proper saturation
-            pattern = self.widths[:self.num_colors]
-            colors = self.get_current_saturated_colors()[:self.num_colors]
-
-            # Determine background color
-            if self.transparent_bg:
-                bg_color = None
-            else:
-                # Use the properly saturated background color
-                bg_color = self.set_color_saturation(self.background_color,
-                                                     int(self.background_saturation * 100))
-
-            # Generate full illusion
-            fig = self.generate_full_illusion(pattern, self.num_patterns, colors, bg_color, self.shift_angle)
-
-            # Close previous figure if it exists
-            if self.current_figure is not None:
-                plt.close(self.current_figure)
-
-            self.current_figure = fig
-
-            # Clear previous canvas
-            for i in reversed(range(self.canvas_frame.layout().count())):
-                widget = self.canvas_frame.layout().itemAt(i).widget()
-                if widget:
-                    widget.deleteLater()
-
-            # Create new canvas
-            canvas = FigureCanvas(fig)
-            self.canvas_frame.layout().addWidget(canvas)
+            spec = self.current_spec()
+        except ValueError as e:
+            # Settings can be invalid in the middle of a change, e.g. classic with 3 colors
+            print(f"Illusion error: {e}")
+            return
+        if spec == self.last_illusion_spec:
+            return
+        self.last_illusion_spec = spec
+        self.render_thread.request(spec)
 
+    def show_rendered_illusion(self, request_id, image, spec):
+        """Display a finished background render unless a newer one is already queued"""
+        if request_id != self.render_thread.latest_id:
+            return
+        try:
+            self.show_illusion_image(image, spec.background)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error generating illusion: {e}")
 
-    def save_illusion(self):
+    def show_illusion_image(self, image, background):
+        """Show an illusion image, creating the figure and its canvas only once"""
         if self.current_figure is None:
-            QMessageBox.information(self, "Info", "Generate an illusion first")
+            self.current_figure = self.create_illusion_figure(image, background)
+            self.canvas_frame.layout().addWidget(FigureCanvas(self.current_figure))
             return
 
+        # Later illusions only replace the image of the existing figure
+        self.current_figure.axes[0].images[0].set_data(image)
+        if background is None:
+            self.current_figure.patch.set_alpha(0.0)
+        else:
+            self.current_figure.patch.set_alpha(None)
+            self.current_figure.patch.set_facecolor(background)
+        self.current_figure.canvas.draw_idle()
+
+    def save_illusion(self):
         try:
             # Generate filename with all parameters
-            colors_str = '-'.join([self.colors[i].replace('#', '') for i in range(self.num_colors)])
-            saturations_str = '-'.join([f"{int(self.color_saturation[i] * 100)}" for i in range(self.num_colors)])
-            widths_str = '-'.join([f"{self.widths[i]:.1f}" for i in range(self.num_colors)])
-
-            if self.num_colors == 3:
-                colors_str += "-X"
-                saturations_str += "-X"
-                widths_str += "-X"
-
-            # Add background specification - either transparent or hex code
-            if self.transparent_bg:
-                bg_str = "bg-transparent"
-            else:
-                # Get the actual background color with saturation applied
-                actual_bg = self.set_color_saturation(self.background_color,
-                                                      int(self.background_saturation * 100))
-                bg_str = f"bg-{actual_bg.replace('#', '')}"
-
-            # Add pattern type to filename
-            pattern_type_str = "classic" if self.use_classic_pattern else "reversed"
-
-            # Updated filename format with pattern type
-            default_filename = (f"snake_illusion_p{self.num_patterns}_c{colors_str}_"
-                                f"s{saturations_str}_w{widths_str}_a{self.shift_angle:.1f}_{bg_str}_{pattern_type_str}.png")
+            default_filename = illusion_filename(self.colors[:self.num_colors],
+                                                 [s * 100 for s in self.color_saturation[:self.num_colors]],
+                                                 self.widths[:self.num_colors], self.num_patterns,
+                                                 self.shift_angle, self.current_background(),
+                                                 self.use_classic_pattern)
 
             # Get save path
             file_path, _ = QFileDialog.getSaveFileName(
@@ -744,8 +793,18 @@ class SnakeIllusionApp(QMainWindow):
             )
 
             if file_path:
-                self.current_figure.savefig(file_path, dpi=100, bbox_inches='tight',
-                                            pad_inches=0, transparent=self.transparent_bg)
+                spec = self.current_spec()
+                render_args = spec.canonical_args(DEFAULT_SIZE)
+                key = cache_key(*render_args)
+
+                if not self.render_cache.get(key, file_path):
+                    # Render the current settings here so the file never holds a stale background render
+                    image = render_spec(spec)
+                    self.show_illusion_image(image, spec.background)
+
+                    # The raster is exactly what savefig would write, so encode it directly
+                    write_png(file_path, image, text=params_text(canonical_params(*render_args)))
+                    self.render_cache.put(key, file_path)
                 QMessageBox.information(self, "Success", f"File saved as: {file_path}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Error saving file: {e}")
@@ -758,18 +817,9 @@ class SnakeIllusionApp(QMainWindow):
 
         try:
             # Generate filename with parameters
-            colors_str = '-'.join([self.colors[i].replace('#', '') for i in range(self.num_colors)])
-            saturations_str = '-'.join([f"{int(self.color_saturation[i] * 100)}" for i in range(self.num_colors)])
-            widths_str = '-'.join([f"{self.widths[i]:.1f}" for i in range(self.num_colors)])
-
-            if self.num_colors == 3:
-                colors_str += "-X"
-                saturations_str += "-X"
-                widths_str += "-X"
-
-            # Filename for preview
-            default_filename = (f"single_pattern_c{colors_str}_"
-                                f"s{saturations_str}_w{widths_str}.png")
+            default_filename = preview_filename(self.colors[:self.num_colors],
+                                                [s * 100 for s in self.color_saturation[:self.num_colors]],
+                                                self.widths[:self.num_colors])
 
             # Get save path
             file_path, _ = QFileDialog.getSaveFileName(
@@ -781,15 +831,13 @@ class SnakeIllusionApp(QMainWindow):
                 pattern = self.widths[:self.num_colors]
                 colors = self.get_current_saturated_colors()[:self.num_colors]
 
-                # Generate a transparent version of the preview
-                temp_fig = self.generate_preview(pattern, self.num_patterns, colors, None, self.shift_angle)
-
-                # Save with transparent background to extract only the pattern
-                temp_fig.savefig(file_path, dpi=100, bbox_inches='tight',
-                                 pad_inches=0, transparent=True)
-
-                # Close the temporary figure
-                plt.close(temp_fig)
+                # Rasterize the pattern with a transparent background to extract only the pattern
+                image = render_pattern_strip(pattern, colors, None)
+                write_png(file_path, image, text=params_text({
+                    "colors": [c.lower() for c in colors],
+                    "widths": [round(float(w), 6) for w in pattern],
+                    "size": list(STRIP_SIZE)
+                }))
 
                 QMessageBox.information(self, "Success", f"Pattern-only preview saved as: {file_path}")
         except Exception as e:
@@ -843,13 +891,27 @@ class SnakeIllusionApp(QMainWindow):
             self.width_spins[i].setValue(1.0)  # Reset width spinbox
 
         QMessageBox.information(self, "Reset", "All settings reset to defaults")
-        self.update_preview()
+        self.request_preview()
 
     def generate_preview(self, pattern, num_patterns, colors, background, shift_angle):
         """Generate a simple preview of the pattern showing all colors, properly centered vertically"""
         # Create a compact figure
         fig, ax = plt.subplots(figsize=(4, 2))
 
+        # Configure plot - set y limits to center the bar vertically
+        ax.set_xlim(0, 1)
+        ax.set_ylim(-0.25, 0.25)  # Center the bar vertically
+        ax.set_aspect('auto')
+        ax.axis('off')
+        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
+
+        self.update_preview_figure(fig, pattern, colors, background)
+        return fig
+
+    def update_preview_figure(self, fig, pattern, colors, background):
+        """Update the bars and background of a preview figure in place"""
+        ax = fig.axes[0]
+
         # Only use the colors we need based on num_colors
         colors_to_use = colors[:self.num_colors]
         pattern_to_use = pattern[:self.num_colors]
@@ -869,78 +931,41 @@ class SnakeIllusionApp(QMainWindow):
             positions.append((current_pos, relative_width))
             current_pos += relative_width
 
-        # Draw the bars - use y=0 to center vertically
-        for i, (pos, width) in enumerate(positions):
-            ax.barh(0, width=width, left=pos, height=bar_height, color=colors_to_use[i])
-
-        # Configure plot - set y limits to center the bar vertically
-        ax.set_xlim(0, 1)
-        ax.set_ylim(-0.25, 0.25)  # Center the bar vertically
-        ax.set_aspect('auto')
+        if len(ax.patches) == len(positions):
+            # Same number of colors: move and recolor the existing bars
+            for bar, (pos, width), color in zip(ax.patches, positions, colors_to_use):
+                bar.set_x(pos)
+                bar.set_width(width)
+                bar.set_facecolor(color)
+        else:
+            # Number of colors changed: draw the bars again - use y=0 to center vertically
+            for bar in list(ax.patches):
+                bar.remove()
+            for i, (pos, width) in enumerate(positions):
+                ax.barh(0, width=width, left=pos, height=bar_height, color=colors_to_use[i])
 
         # Set background
         if background is None:  # Transparent
             fig.patch.set_alpha(0.0)
             ax.set_facecolor('none')
         else:
+            fig.patch.set_alpha(None)
             fig.patch.set_facecolor(background)
             ax.set_facecolor(background)
 
-        ax.axis('off')
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-
-        return fig
-
     def generate_full_illusion(self, width_pattern, pattern_repeats, left_colors, background, shift_angle):
         """Generate the full snake illusion"""
-        # Create the repeating pattern for left circle (original)
-        colors_length = len(left_colors)
-        left_pattern_widths = width_pattern * pattern_repeats
+        # The spec rejects classic patterns without exactly 4 colors
+        spec = IllusionSpec(left_colors, width_pattern, pattern_repeats, shift_angle, background,
+                            self.use_classic_pattern)
+        return self.create_illusion_figure(render_spec(spec), background)
 
+    def create_illusion_figure(self, image, background):
+        """Create a figure showing a rendered illusion image"""
         # Setup figure
         fig, ax = plt.subplots(figsize=(8, 6))
-        inner_r = np.array(np.linspace(1, 0.03, num=9)) * 2
-        x = 2
-
-        # Left circle (original pattern)
-        startangle = 90
-        for radius in range(len(inner_r)):
-            startangle += shift_angle
-            left_color_list = left_colors * pattern_repeats
-            ax.pie(left_pattern_widths, colors=left_color_list, radius=inner_r[radius],
-                   center=(-x, 0), startangle=startangle, counterclock=False)
-
-        # Left center circle
-        center_color = ['none'] if background is None else [background]
-        ax.pie([1], colors=center_color, radius=inner_r[8],
-               center=(-x, 0), counterclock=False)
-
-        # Generate right circle pattern based on pattern type
-        if self.use_classic_pattern:
-            # Safety check: Classic pattern only works with 4 colors
-            if colors_length != 4:
-                print(f"Warning: Classic pattern requires 4 colors, got {colors_length}")
-
-            # Classic: swap colors and widths [0,1,2,3] -> [0,3,2,1]
-            right_colors = [left_colors[0], left_colors[3], left_colors[2], left_colors[1]]
-            right_width_pattern = [width_pattern[0], width_pattern[3], width_pattern[2], width_pattern[1]]
-            right_pattern_widths = right_width_pattern * pattern_repeats
-        else:
-            # Complete reversal: reverse everything
-            right_colors = left_colors[::-1]
-            right_pattern_widths = left_pattern_widths[::-1]
-
-        # Right circle
-        startangle = 90  # Reset startangle
-        for radius in range(len(inner_r)):
-            startangle += shift_angle
-            right_color_list = right_colors * pattern_repeats
-            ax.pie(right_pattern_widths, colors=right_color_list, radius=inner_r[radius],
-                   center=(x, 0), startangle=startangle, counterclock=False)
-
-        # Right center circle
-        ax.pie([1], colors=center_color, radius=inner_r[8],
-               center=(x, 0), counterclock=False)
+        # The image extends past the axes like the pie wedges did, so keep it unclipped
+        ax.imshow(image, extent=VIEW_EXTENT, interpolation='nearest').set_clip_on(False)
 
         # Background and display settings
         if background is None:
@@ -959,6 +984,9 @@ class SnakeIllusionApp(QMainWindow):
 
     def closeEvent(self, event):
         """Clean up when window is closed"""
+        self.update_timer.stop()
+        self.render_thread.stop()
+        self.render_cache.close()
         plt.close('all')
         event.accept()
 
@@ -984,28 +1012,11 @@ class SnakeIllusionApp(QMainWindow):
             }
 
             # Generate filename with all parameters - matching the illusion naming convention
-            colors_str = '-'.join([self.colors[i].replace('#', '') for i in range(self.num_colors)])
-            saturations_str = '-'.join([f"{int(self.color_saturation[i] * 100)}" for i in range(self.num_colors)])
-            widths_str = '-'.join([f"{self.widths[i]:.1f}" for i in range(self.num_colors)])
-
-            if self.num_colors == 3:
-                colors_str += "-X"
-                saturations_str += "-X"
-                widths_str += "-X"
-
-            # Add background specification - either transparent or hex code
-            if self.transparent_bg:
-                bg_str = "bg-transparent"
-            else:
-                # Get the actual background color with saturation applied
-                actual_bg = self.set_color_saturation(self.background_color,
-                                                      int(self.background_saturation * 100))
-                bg_str = f"bg-{actual_bg.replace('#', '')}"
-
-            # Use the same format as illusion filenames, but with .json extension
-            pattern_type_str = "classic" if self.use_classic_pattern else "reversed"
-            default_filename = (f"snake_illusion_p{self.num_patterns}_c{colors_str}_"
-                                f"s{saturations_str}_w{widths_str}_a{self.shift_angle:.1f}_{bg_str}_{pattern_type_str}.json")
+            default_filename = illusion_filename(self.colors[:self.num_colors],
+                                                 [s * 100 for s in self.color_saturation[:self.num_colors]],
+                                                 self.widths[:self.num_colors], self.num_patterns,
+                                                 self.shift_angle, self.current_background(),
+                                                 self.use_classic_pattern, extension="json")
 
             file_path, _ = QFileDialog.getSaveFileName(
                 self, "Save Project", default_filename, "JSON Files (*.json);;All Files (*)"
@@ -1042,8 +1053,8 @@ class SnakeIllusionApp(QMainWindow):
 
             # Update UI for background
             self.bg_color_btn.set_color(self.background_color)
-            self.bg_sat_slider.setValue(int(self.background_saturation * 100))
-            self.bg_sat_spin.setValue(int(self.background_saturation * 100))
+            self.bg_sat_slider.setValue(saturation_percent(self.background_saturation))
+            self.bg_sat_spin.setValue(saturation_percent(self.background_saturation))
             self.bg_hex_value.setText(f"Hex: {self.background_color}")
             self.transparent_check.setChecked(self.transparent_bg)
             self.bg_color_btn.setEnabled(not self.transparent_bg)
@@ -1098,7 +1109,7 @@ class SnakeIllusionApp(QMainWindow):
             self.set_num_colors(self.num_colors)
 
             # Update the preview
-            self.update_preview()
+            self.request_preview()
 
             QMessageBox.information(self, "Success", f"Project loaded from: {file_path}")
 
@@ -0,0 +1,259 @@
+"""Columnar tables of project settings for sweeps with millions of points.
+
+Usage:
+    python spec_table.py sweep sweep.json specs.npy
+    python spec_table.py import project1.json project2.json -o specs.npy
+    python spec_table.py export specs.npy projects/ --start 0 --stop 100
+    python spec_table.py info specs.npy
+
+A table is a .npy file holding one SPEC_DTYPE record per project: the same
+fields as a project JSON saved from the GUI, with colors packed as 0xRRGGBB
+integers. About 110 bytes per point, so a million points take about 110 MB.
+
+Tables are written in chunks and opened memory-mapped, so neither writing
+nor reading builds a Python dict per point. iter_specs resolves the
+saturated colors of whole chunks at once and yields IllusionSpec objects,
+and iter_params yields project dicts again for tools that need them.
+batch_generate.py accepts a table in place of a sweep file.
+
+Colors keep their hex spelling, as a bit mask of the uppercase digits.
+Filenames spell gray colors as given, so batch_generate.py names the files
+of a table exactly as those of the sweep or projects it was built from.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from illusion_colors import rgb_to_hex_array, set_rgb_saturations
+from illusion_spec import IllusionSpec, expand_sweep, illusion_filename, params_background, params_colors, \
+    saturation_percent, sweep_size
+
+MAX_COLORS = 4
+SPEC_DTYPE = np.dtype([
+    ("colors", np.uint32, (MAX_COLORS,)),  # 0xRRGGBB before saturation, unused entries are 0
+    ("saturations", np.float64, (MAX_COLORS,)),  # Percentages, as in project files
+    ("widths", np.float64, (MAX_COLORS,)),
+    ("num_colors", np.uint8),
+    ("num_patterns", np.int32),
+    ("shift_angle", np.float64),
+    ("colors_case", np.uint8, (MAX_COLORS,)),  # Bit i set where hex digit i is uppercase
+    ("background", np.uint32),
+    ("background_case", np.uint8),
+    ("background_saturation", np.float64),  # 0-1, as in project files
+    ("transparent", np.bool_),
+    ("use_classic_pattern", np.bool_)
+])
+CHUNK_SIZE = 65536
+
+
+def _unpack(packed):
+    """Unpack 0xRRGGBB integers into an int RGB array of shape (..., 3)"""
+    packed = np.asarray(packed, dtype=np.int64)
+    return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=-1)
+
+
+def _hex_int(hex_color):
+    """0xRRGGBB integer of a hex color, with or without '#'"""
+    return int(hex_color.lstrip('#'), 16)
+
+
+def _case_mask(hex_color):
+    """Bit mask of the uppercase digits of a hex color"""
+    return sum(1 << i for i, digit in enumerate(hex_color.lstrip('#')) if digit.isupper())
+
+
+def _hex_str(packed, case):
+    """Hex color of a 0xRRGGBB integer, spelled as recorded by _case_mask"""
+    return '#' + ''.join(digit.upper() if case >> i & 1 else digit for i, digit in enumerate(f"{packed:06x}"))
+
+
+def params_records(params_list):
+    """Convert a list of project dicts into a SPEC_DTYPE array"""
+    rows = []
+    for params in params_list:
+        num_colors = len(params["colors"])
+        if num_colors not in (3, 4):
+            raise ValueError(f"Expected 3 or 4 colors, got {num_colors}")
+        padding = [0] * (MAX_COLORS - num_colors)
+        background = params["background"]
+        rows.append(([_hex_int(c) for c in params["colors"]] + padding,
+                     list(params["saturations"][:num_colors]) + padding,
+                     list(params["widths"][:num_colors]) + padding, num_colors, params["num_patterns"],
+                     params["shift_angle"], [_case_mask(c) for c in params["colors"]] + padding,
+                     _hex_int(background["color"]), _case_mask(background["color"]), background["saturation"],
+                     background["transparent"], params["use_classic_pattern"]))
+    return np.array(rows, dtype=SPEC_DTYPE)
+
+
+def write_table(path, params, count, chunk_size=CHUNK_SIZE):
+    """Write count project dicts from an iterable to a table file, chunk_size at a time.
+
+    The file is written under a temporary name and only replaces path once
+    complete. Raises ValueError if params does not yield exactly count dicts.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    table = np.lib.format.open_memmap(temp_path, mode='w+', dtype=SPEC_DTYPE, shape=(count,))
+    completed = False
+    try:
+        written = 0
+        params = iter(params)
+        for chunk in iter(lambda: list(itertools.islice(params, chunk_size)), []):
+            if written + len(chunk) > count:
+                raise ValueError(f"Expected {count} projects, got more")
+            table[written:written + len(chunk)] = params_records(chunk)
+            written += len(chunk)
+        if written != count:
+            raise ValueError(f"Expected {count} projects, got {written}")
+        table.flush()
+        completed = True
+    finally:
+        # The memory map must be closed before the file is renamed or removed
+        del table
+        if completed:
+            os.replace(temp_path, path)
+        else:
+            os.remove(temp_path)
+
+
+def write_sweep_table(path, sweep, chunk_size=CHUNK_SIZE):
+    """Write every project dict of a sweep spec to a table file. Returns the number of points."""
+    count = sweep_size(sweep)
+    write_table(path, expand_sweep(sweep), count, chunk_size)
+    return count
+
+
+def load_table(path):
+    """Open a table file memory-mapped and read-only"""
+    try:
+        table = np.load(path, mmap_mode='r')
+    except ValueError:
+        raise ValueError(f"{path} is not a spec table")
+    if not isinstance(table, np.ndarray) or table.dtype != SPEC_DTYPE:
+        raise ValueError(f"{path} is not a spec table")
+    return table
+
+
+def saturated_rgb(table):
+    """Saturated colors and backgrounds of every record, as int RGB arrays.
+
+    Returns (colors, background) with shapes (n, 4, 3) and (n, 3), exactly as
+    params_colors and params_background compute them one project at a time.
+    Transparent records still get their background color.
+    """
+    colors = set_rgb_saturations(_unpack(table["colors"]), table["saturations"].astype(np.int64))
+    # Convert each distinct background saturation with the same helper as params_background
+    values, inverse = np.unique(table["background_saturation"], return_inverse=True)
+    percents = np.array([saturation_percent(value) for value in values.tolist()], dtype=np.int64)
+    background = set_rgb_saturations(_unpack(table["background"]), percents[inverse.reshape(-1)])
+    return colors, background
+
+
+def _chunks(table, start, stop, chunk_size):
+    stop = len(table) if stop is None else min(stop, len(table))
+    for chunk_start in range(start, stop, chunk_size):
+        yield np.asarray(table[chunk_start:min(chunk_start + chunk_size, stop)])
+
+
+def iter_specs(table, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    """Yield the IllusionSpec of every record, resolving the colors a chunk at a time"""
+    for chunk in _chunks(table, start, stop, chunk_size):
+        colors, background = saturated_rgb(chunk)
+        color_rows = rgb_to_hex_array(colors).tolist()
+        background_rows = rgb_to_hex_array(background).tolist()
+        for record, spec_colors, spec_background in zip(chunk.tolist(), color_rows, background_rows):
+            (_, _, widths, num_colors, num_patterns, shift_angle, _, _, _, _, transparent,
+             use_classic_pattern) = record
+            yield IllusionSpec(spec_colors[:num_colors], widths[:num_colors].tolist(), num_patterns, shift_angle,
+                               None if transparent else spec_background, use_classic_pattern)
+
+
+def iter_params(table, start=0, stop=None, chunk_size=CHUNK_SIZE):
+    """Yield every record as a project dict in the schema saved by the GUI"""
+    for chunk in _chunks(table, start, stop, chunk_size):
+        for record in chunk.tolist():
+            (colors, saturations, widths, num_colors, num_patterns, shift_angle, colors_case, background,
+             background_case, background_saturation, transparent, use_classic_pattern) = record
+            yield {
+                "background": {
+                    "color": _hex_str(background, background_case),
+                    "saturation": background_saturation,
+                    "transparent": transparent
+                },
+                "colors": [_hex_str(c, case) for c, case in zip(colors[:num_colors].tolist(),
+                                                                colors_case[:num_colors].tolist())],
+                "saturations": saturations[:num_colors].tolist(),
+                "widths": widths[:num_colors].tolist(),
+                "num_patterns": num_patterns,
+                "shift_angle": shift_angle,
+                "num_colors": num_colors,
+                "use_classic_pattern": use_classic_pattern
+            }
+
+
+def export_projects(table, output_dir, start=0, stop=None):
+    """Write records as project JSON files named like "Save Project" in the GUI. Returns their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for params in iter_params(table, start, stop):
+        project = {"date_created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "app_version": "1.0.0"}
+        project.update(params)
+        file_path = os.path.join(output_dir, illusion_filename(
+            params_colors(params), params["saturations"], params["widths"], params["num_patterns"],
+            params["shift_angle"], params_background(params), params["use_classic_pattern"], extension="json"))
+        with open(file_path, 'w') as f:
+            json.dump(project, f, indent=2)
+        paths.append(file_path)
+    return paths
+
+
+def _load_projects(paths):
+    for path in paths:
+        with open(path, 'r') as f:
+            yield json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between sweeps, project files and spec tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sweep_parser = commands.add_parser("sweep", help="Write every point of a sweep file to a table")
+    sweep_parser.add_argument("sweep", help="Sweep JSON file, see batch_generate.py")
+    sweep_parser.add_argument("table", help="Output .npy table")
+    import_parser = commands.add_parser("import", help="Write project files to a table")
+    import_parser.add_argument("projects", nargs="+", help="Project JSON files saved from the GUI")
+    import_parser.add_argument("-o", "--output", required=True, help="Output .npy table")
+    export_parser = commands.add_parser("export", help="Write table records as project files")
+    export_parser.add_argument("table", help="Table file")
+    export_parser.add_argument("output_dir", help="Directory for the project JSON files")
+    export_parser.add_argument("--start", type=int, default=0, help="First record to export")
+    export_parser.add_argument("--stop", type=int, help="Record to stop before (default: the end)")
+    info_parser = commands.add_parser("info", help="Show the size of a table")
+    info_parser.add_argument("table", help="Table file")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "sweep":
+            with open(args.sweep, 'r') as f:
+                count = write_sweep_table(args.table, json.load(f))
+            print(f"{count} points written to {args.table}")
+        elif args.command == "import":
+            write_table(args.output, _load_projects(args.projects), len(args.projects))
+            print(f"{len(args.projects)} projects written to {args.output}")
+        elif args.command == "export":
+            paths = export_projects(load_table(args.table), args.output_dir, args.start, args.stop)
+            print(f"{len(paths)} projects written to {args.output_dir}")
+        else:
+            table = load_table(args.table)
+            print(f"{len(table)} points, {table.nbytes / 1024 ** 2:.1f} MB")
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
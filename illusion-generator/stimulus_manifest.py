@@ -0,0 +1,219 @@
+"""Indexed manifest of generated stimuli.
+
+Every stimulus gets an id, its file (relative to the manifest), a hash of
+the file contents, the render cache key of its parameters and the full
+project dict. The parameters are also stored in indexed columns, so the
+experiment and analysis tools can look stimuli up by any parameter instead
+of parsing filenames.
+
+Usage:
+    python stimulus_manifest.py stimuli/manifest.sqlite query num_patterns=24 pattern_type=classic
+    python stimulus_manifest.py stimuli/manifest.sqlite js saturation_pattern=100-70-40-10 \\
+        --fields saturation_pattern colors pattern_type
+
+The js command prints imageMapping and imageParameters blocks for
+psychophysical-experiment.js. The fields are stored as param1, param2, ...
+in order, which the experiment records with every trial.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+from illusion_spec import PATTERN_TYPES
+
+MANIFEST_NAME = "manifest.sqlite"
+
+# Queryable columns and their SQL types, after id and file
+COLUMNS = {
+    "content_hash": "TEXT",
+    "param_hash": "TEXT",
+    "colors": "TEXT",
+    "saturated_colors": "TEXT",
+    "saturation_pattern": "TEXT",
+    "widths": "TEXT",
+    "num_patterns": "INTEGER",
+    "shift_angle": "REAL",
+    "background": "TEXT",
+    "background_saturation": "REAL",
+    "transparent": "INTEGER",
+    "pattern_type": "TEXT",
+    "num_colors": "INTEGER"
+}
+DEFAULT_JS_FIELDS = ["saturation_pattern", "colors", "pattern_type"]
+
+
+def file_hash(file_path):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _join(values, fmt="{}"):
+    """Join list values with dashes, like the parts of an illusion filename"""
+    return '-'.join(fmt.format(v).replace('#', '') for v in values)
+
+
+def _color_str(colors):
+    """Dash-joined lowercase colors, so color queries ignore case"""
+    return _join(colors).lower()
+
+
+def manifest_columns(params, saturated_colors=None):
+    """Queryable column values of a project dict (without the hashes)"""
+    background = params["background"]
+    pattern_type = {v: k for k, v in PATTERN_TYPES.items()}[bool(params["use_classic_pattern"])]
+    return {
+        "colors": _color_str(params["colors"]),
+        "saturated_colors": _color_str(saturated_colors) if saturated_colors is not None else None,
+        "saturation_pattern": _join([int(s) for s in params["saturations"]]),
+        "widths": _join(params["widths"], "{:.1f}"),
+        "num_patterns": int(params["num_patterns"]),
+        "shift_angle": float(params["shift_angle"]),
+        "background": background["color"].replace('#', '').lower(),
+        "background_saturation": float(background["saturation"]),
+        "transparent": int(bool(background["transparent"])),
+        "pattern_type": pattern_type,
+        "num_colors": len(params["colors"])
+    }
+
+
+def _filter_value(column, value):
+    """Convert a query value to the stored form of its column"""
+    color_column = column in ("colors", "saturated_colors", "background")
+    if isinstance(value, (list, tuple)):
+        if color_column:
+            return _color_str(value)
+        return _join(value, "{:.1f}" if column == "widths" else "{}")
+    if isinstance(value, str) and color_column:
+        return value.replace('#', '').lower()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class StimulusManifest:
+    """SQLite index of stimulus files and their parameters"""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        columns = ', '.join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS stimuli (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                            f"file TEXT UNIQUE, {columns}, params TEXT, created TEXT)")
+            for name in COLUMNS:
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS stimuli_{name} ON stimuli ({name})")
+
+    def add(self, params, file_path, param_hash=None, saturated_colors=None):
+        """Record a written stimulus, replacing any earlier entry for the same file. Returns its id."""
+        relative_path = os.path.relpath(os.path.abspath(file_path), self.directory)
+        values = manifest_columns(params, saturated_colors)
+        values.update(content_hash=file_hash(file_path), param_hash=param_hash)
+        names = list(COLUMNS)
+        with self.db:
+            # An upsert keeps the id of a stimulus that is written again
+            self.db.execute(
+                f"INSERT INTO stimuli (file, {', '.join(names)}, params, created) "
+                f"VALUES (?, {', '.join('?' for _ in names)}, ?, ?) "
+                f"ON CONFLICT(file) DO UPDATE SET {', '.join(f'{n} = excluded.{n}' for n in names)}, "
+                "params = excluded.params, created = excluded.created",
+                [relative_path] + [values[n] for n in names] +
+                [json.dumps(params), datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+            row = self.db.execute("SELECT id FROM stimuli WHERE file = ?", (relative_path,)).fetchone()
+        return row["id"]
+
+    def query(self, **filters):
+        """Return the stimuli matching every column=value filter, in id order, as dicts"""
+        unknown = set(filters) - set(COLUMNS) - {"id", "file"}
+        if unknown:
+            raise ValueError(f"Unknown manifest columns: {', '.join(sorted(unknown))}")
+        where = ' AND '.join(f"{name} = ?" for name in filters) or "1"
+        rows = self.db.execute(f"SELECT * FROM stimuli WHERE {where} ORDER BY id",
+                               [_filter_value(name, value) for name, value in filters.items()])
+        return [dict(row) for row in rows]
+
+    def file_path(self, row):
+        """Absolute path of a stimulus returned by query"""
+        return os.path.join(self.directory, row["file"])
+
+    def close(self):
+        self.db.close()
+
+
+def stimulus_key(row):
+    """Key of a stimulus in the experiment's imageMapping"""
+    return f"img{row['id']}"
+
+
+def javascript_blocks(rows, fields=DEFAULT_JS_FIELDS):
+    """Return the imageMapping and imageParameters declarations for psychophysical-experiment.js"""
+    mapping = [f"  '{stimulus_key(row)}': {json.dumps(row['file'].replace(os.sep, '/'))}" for row in rows]
+    parameters = []
+    for row in rows:
+        values = ', '.join(f"param{i + 1}: {json.dumps(row[field])}" for i, field in enumerate(fields))
+        parameters.append(f"  '{stimulus_key(row)}': {{ {values} }}")
+
+    legend = ', '.join(f"param{i + 1} = {field}" for i, field in enumerate(fields))
+    return ("// Generated by stimulus_manifest.py\n"
+            "var imageMapping = {\n" + ',\n'.join(mapping) + "\n};\n\n"
+            f"// {legend}\n"
+            "var imageParameters = {\n" + ',\n'.join(parameters) + "\n};\n")
+
+
+def parse_filters(terms):
+    """Parse column=value command line terms into a dict"""
+    filters = {}
+    for term in terms:
+        name, separator, value = term.partition('=')
+        if not separator:
+            raise ValueError(f"Expected column=value, got {term!r}")
+        filters[name] = value
+    return filters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query a stimulus manifest written by batch_generate.py")
+    parser.add_argument("manifest", help="Manifest file")
+    parser.add_argument("command", choices=["query", "js"])
+    parser.add_argument("filters", nargs="*", help="column=value filters, for example num_patterns=24")
+    parser.add_argument("--fields", nargs="+", default=DEFAULT_JS_FIELDS,
+                        help="Columns written as param1, param2, ... by the js command")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.manifest):
+        print(f"Error: {args.manifest} does not exist", file=sys.stderr)
+        return 1
+    manifest = StimulusManifest(args.manifest)
+    try:
+        unknown = set(args.fields) - set(COLUMNS) - {"id", "file"}
+        if unknown:
+            raise ValueError(f"Unknown manifest columns: {', '.join(sorted(unknown))}")
+        rows = manifest.query(**parse_filters(args.filters))
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        manifest.close()
+
+    if args.command == "js":
+        print(javascript_blocks(rows, args.fields), end='')
+    else:
+        for row in rows:
+            print(f"{stimulus_key(row)}\t{row['file']}\t{row['content_hash'][:12]}\t"
+                  f"{row['saturation_pattern']}\t{row['pattern_type']}\tp{row['num_patterns']}\t"
+                  f"a{row['shift_angle']:g}")
+        print(f"{len(rows)} stimuli", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Job ledger that lets an interrupted sweep resume where it stopped.
+
+Every finished stimulus is recorded with the render cache key of its
+parameters and the size and modification time of the written file. When the
+sweep runs again, a stimulus is skipped only if its file still exists
+unchanged and its parameters hash to the same key, so changed or missing
+stimuli are rendered again.
+"""
+import os
+import sqlite3
+import time
+
+LEDGER_NAME = "sweep_ledger.sqlite"
+
+
+def _file_stat(file_path):
+    """(size, mtime) of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+class JobLedger:
+    """SQLite record of the finished and failed jobs of a sweep"""
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS jobs (file TEXT PRIMARY KEY, param_hash TEXT, "
+                            "status TEXT, size INTEGER, mtime REAL, error TEXT, updated REAL)")
+
+    def _key(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.directory)
+
+    def is_done(self, file_path, param_hash):
+        """Whether file_path was written for param_hash and has not changed since"""
+        row = self.db.execute("SELECT param_hash, size, mtime FROM jobs WHERE file = ? AND status = 'done'",
+                              (self._key(file_path),)).fetchone()
+        return row is not None and row[0] == param_hash and _file_stat(file_path) == (row[1], row[2])
+
+    def mark_done(self, file_path, param_hash):
+        size, mtime = _file_stat(file_path)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, 'done', ?, ?, NULL, ?)",
+                            (self._key(file_path), param_hash, size, mtime, time.time()))
+
+    def mark_failed(self, file_path, param_hash, error):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, 'failed', NULL, NULL, ?, ?)",
+                            (self._key(file_path), param_hash, error, time.time()))
+
+    def counts(self):
+        """Number of jobs per status"""
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        self.db.close()
+
+
+class Progress:
+    """Throughput and ETA of a sweep, measured over the stimuli actually rendered"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.rendered = 0
+        self.start = time.perf_counter()
+
+    def update(self, skipped=False):
+        self.done += 1
+        if not skipped:
+            self.rendered += 1
+
+    def rate(self):
+        """Rendered stimuli per second so far"""
+        elapsed = time.perf_counter() - self.start
+        return self.rendered / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Estimated seconds left, or None before anything has been rendered"""
+        rate = self.rate()
+        if not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def format(self):
+        eta = self.eta()
+        if eta is None:
+            return f"[{self.done}/{self.total}]"
+        minutes, seconds = divmod(int(round(eta)), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"[{self.done}/{self.total}, {self.rate():.1f}/s, ETA {hours}:{minutes:02d}:{seconds:02d}]"